@@ -0,0 +1,128 @@
+import numpy as np
+import pygal
+import matrix
+from cache import cached
+
+Positions = ["ja", "nein", "Enthaltung"]
+
+
+template = """
+Geschlossenheit der Fraktionen
+==============================
+
+Agreement Index nach Jahr
+-------------------------
+{{ plot("agreement_by_year") }}
+
+Rice Index nach Jahr
+--------------------
+{{ plot("rice_by_year") }}
+
+Übereinstimmung der Fraktionen (in %)
+-------------------------------------
+{% for term in this.terms() %}
+{{ term }}. Wahlperiode
+~~~~~~~~~~~~~~~~~~~~~~~~~
+{{ plot("agreement_between_groups", term) }}
+{% endfor %}
+"""
+
+
+def position_counts(votes: matrix.VoteMatrix) -> np.ndarray:
+    # ballots per group, voting and position, counted in one pass over all cells
+    cast = (votes.results >= 1) & (votes.results <= len(Positions))
+    delegates, votings = np.nonzero(cast)
+    groups = votes.groups[delegates, votings].astype(np.int64) - 1
+    positions = votes.results[delegates, votings].astype(np.int64) - 1
+    shape = (len(votes.group_names), len(votes.voting_ids), len(Positions))
+    cells = np.ravel_multi_index((groups, votings, positions), shape)
+    return np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(
+        numerator, denominator,
+        out=np.full(numerator.shape, np.nan), where=denominator > 0
+    )
+
+
+@cached
+def cohesion() -> dict:
+    votes = matrix.load()
+    counts = position_counts(votes)
+    yes, no = counts[..., 0], counts[..., 1]
+    total = counts.sum(axis=2)
+    top = counts.max(axis=2)
+    return dict(
+        group_names=list(votes.group_names),
+        voting_terms=np.array(votes.voting_terms),
+        voting_years=np.array(votes.voting_dates).astype("datetime64[Y]").astype(int) + 1970,
+        rice=ratio(np.abs(yes - no), yes + no),
+        agreement=ratio(top - 0.5 * (total - top), total),
+        # ties go to the first position, groups without ballots are -1
+        majority=np.where(total > 0, counts.argmax(axis=2), -1),
+    )
+
+
+def terms():
+    return [int(term) for term in np.unique(cohesion()["voting_terms"])]
+
+
+def yearly_means(values: np.ndarray, years: np.ndarray):
+    labels, columns = np.unique(years, return_inverse=True)
+    rows, cells = np.nonzero(~np.isnan(values))
+    sums = np.zeros((values.shape[0], len(labels)))
+    counts = np.zeros((values.shape[0], len(labels)))
+    np.add.at(sums, (rows, columns[cells]), values[rows, cells])
+    np.add.at(counts, (rows, columns[cells]), 1)
+    return [int(year) for year in labels], ratio(sums, counts)
+
+
+def by_year(index: str, title: str):
+    data = cohesion()
+    years, means = yearly_means(data[index], data["voting_years"])
+
+    line_chart = pygal.Line(title=title, range=(0, 1), x_label_rotation=45)
+    line_chart.x_labels = years
+    for group, values in zip(data["group_names"], means):
+        if not np.isnan(values).all():
+            line_chart.add(group, [
+                None if np.isnan(value) else float(f"{value:.3f}")
+                for value in values
+            ])
+    return line_chart
+
+
+def agreement_by_year():
+    return by_year("agreement", "Agreement Index")
+
+
+def rice_by_year():
+    return by_year("rice", "Rice Index")
+
+
+@cached
+def group_agreement(term: int):
+    # share of the votings of a term in which the majorities of two groups voted alike
+    data = cohesion()
+    majority = data["majority"][:, data["voting_terms"] == term]
+    present = (majority >= 0).astype(np.int64)
+    positions = (majority[..., np.newaxis] == np.arange(len(Positions))).astype(np.int64)
+    agreeing = np.einsum("gvp,hvp->gh", positions, positions)
+    shares = ratio(agreeing, present @ present.T)
+
+    groups = np.nonzero(present.any(axis=1))[0]
+    return (
+        [data["group_names"][group] for group in groups],
+        shares[np.ix_(groups, groups)],
+    )
+
+
+def agreement_between_groups(term: int):
+    groups, shares = group_agreement(term)
+
+    dot_chart = pygal.Dot(x_label_rotation=30)
+    dot_chart.x_labels = groups
+    for group, row in zip(groups, shares):
+        dot_chart.add(group, [float(f"{share * 100:.2f}") for share in row])
+    return dot_chart
@@ -1,5 +1,7 @@
 import pygal
-from db import database, Ballot, Voting, Delegate, DelegateName, DelegateTerm, fn
+from db import TermGroupResult, TermPartyGender, TermPartyTitle
+from rollup import current_term
+from cache import cached
 
 
 template = """
@@ -20,16 +22,31 @@ Nach Abstimmverhalten (in %)
 """
 
 
-def by_gender():
-    current_term = DelegateTerm.select(fn.Max(DelegateTerm.term)).scalar()
+latest_term = cached(current_term)
+
+
+@cached
+def party_genders(term):
+    return tuple(TermPartyGender.select(TermPartyGender.party, TermPartyGender.gender, TermPartyGender.count).where(
+        (TermPartyGender.term == term) & TermPartyGender.serving).order_by(TermPartyGender.party).tuples())
+
+
+@cached
+def party_titles(term):
+    return tuple(TermPartyTitle.select(TermPartyTitle.party, TermPartyTitle.title, TermPartyTitle.count).where(
+        (TermPartyTitle.term == term) & TermPartyTitle.serving).order_by(TermPartyTitle.party).tuples())
+
 
-    delegates = DelegateName.select(Delegate, fn.COUNT(DelegateName.id).alias('count')).join(Delegate).join(DelegateTerm).where(
-        DelegateTerm.term == current_term and DelegateTerm.term_until == None).group_by(Delegate.party, Delegate.gender).order_by(Delegate.party)
+@cached
+def group_results(term):
+    return tuple(TermGroupResult.select(TermGroupResult.group, TermGroupResult.result, TermGroupResult.count).where(
+        TermGroupResult.term == term).order_by(TermGroupResult.group).tuples())
 
+
+def by_gender():
     stats = {}
-    for delegate in delegates:
-        stats.setdefault(delegate.delegate.party, {})[
-            delegate.delegate.gender] = delegate.count
+    for party, gender, count in party_genders(latest_term()):
+        stats.setdefault(party, {})[gender] = count
     distinct_genders = set()
     for party, genders in stats.items():
         distinct_genders = distinct_genders | set(genders)
@@ -38,7 +55,7 @@ def by_gender():
 
     plot_data = {}
     for party, genders in stats.items():
-        for gender in distinct_genders:
+        for gender in sorted(distinct_genders, key=str):
             percentage = genders.get(gender, 0)
             plot_data.setdefault(gender, {})[party] = percentage
 
@@ -51,15 +68,9 @@ def by_gender():
 
 
 def by_title():
-    current_term = DelegateTerm.select(fn.Max(DelegateTerm.term)).scalar()
-
-    delegates = DelegateName.select(Delegate, DelegateName, fn.COUNT(DelegateName.id).alias('count')).join(Delegate).join(DelegateTerm).where(
-        DelegateTerm.term == current_term and DelegateTerm.term_until == None).group_by(Delegate.party, DelegateName.title).order_by(Delegate.party)
-
     stats = {}
-    for delegate in delegates:
-        stats.setdefault(delegate.delegate.party, {})[
-            delegate.title] = delegate.count
+    for party, title, count in party_titles(latest_term()):
+        stats.setdefault(party, {})[title] = count
     distinct_titles = set()
     for party, titles in stats.items():
         distinct_titles = distinct_titles | set(titles)
@@ -68,7 +79,7 @@ def by_title():
 
     plot_data = {}
     for party, titles in stats.items():
-        for title in distinct_titles:
+        for title in sorted(distinct_titles, key=str):
             percentage = titles.get(title, 0)
             plot_data.setdefault(title, {})[party] = percentage
 
@@ -81,14 +92,9 @@ def by_title():
 
 
 def by_voting_habit():
-    current_term = DelegateTerm.select(fn.Max(DelegateTerm.term)).scalar()
-    by_parties = Ballot().select(Ballot.group, Ballot.result, fn.COUNT(Ballot.id).alias("count")).join(Voting).where(
-        Voting.term == current_term).group_by(Ballot.group, Ballot.result).order_by(Ballot.group)
-
     stats = {}
-    for result in by_parties:
-        stats.setdefault(result.group, {})[
-            result.result] = result.count
+    for group, result, count in group_results(latest_term()):
+        stats.setdefault(group, {})[result] = count
 
     distinct_habits = set()
     for party, habits in stats.items():
@@ -98,7 +104,7 @@ def by_voting_habit():
 
     plot_data = {}
     for party, habits in stats.items():
-        for habit in distinct_habits:
+        for habit in sorted(distinct_habits, key=str):
             percentage = habits.get(habit, 0)
             plot_data.setdefault(habit, {})[party] = percentage
 
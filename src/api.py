@@ -0,0 +1,318 @@
+import re
+import json
+import hashlib
+import argparse
+import threading
+import traceback
+from pathlib import Path
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from playhouse.pool import PooledSqliteDatabase
+from db import Db, Tables, Voting, Ballot, ranked
+from cache import cache
+from loader import import_file
+
+Connections = 8
+PageSize = 100
+MaxPageSize = 1000
+ChunkSize = 65536
+# sqlite integers are 64 bit
+MaxInteger = 2 ** 63 - 1
+Analyses = Path(__file__).parent / "analyses"
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def integer(name: str, value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} has to be an integer")
+    if not -MaxInteger - 1 <= number <= MaxInteger:
+        raise ApiError(400, f"{name} is out of range")
+    return number
+
+
+def parameter(query: dict, name: str, default=None):
+    if name not in query:
+        return default
+    return integer(name, query[name])
+
+
+class Page:
+    # rows of a query streamed as items, one more row than the limit
+    # is fetched to know whether there is a next page
+    def __init__(self, query, item, offset: int, limit: int):
+        self.rows = query.offset(offset).limit(limit + 1).tuples().iterator()
+        self.item = item
+        self.offset = offset
+        self.limit = limit
+        self.more = False
+
+    def __iter__(self):
+        for number, row in enumerate(self.rows):
+            if number == self.limit:
+                self.more = True
+                break
+            yield self.item(*row)
+
+
+def page(query: dict, rows, item) -> Page:
+    limit = parameter(query, "limit", PageSize)
+    offset = parameter(query, "offset", 0)
+    if not 0 < limit <= MaxPageSize or offset < 0:
+        raise ApiError(400, f"limit has to be within 1 and {MaxPageSize}, offset positive")
+    return Page(rows, item, offset, limit)
+
+
+def voting_item(id, term, session, voting, date, title):
+    return dict(id=id, term=term, session=session, voting=voting, date=str(date), title=title)
+
+
+def votings(query: dict):
+    rows = Voting.select(
+        Voting.id, Voting.term, Voting.session, Voting.voting, Voting.date, Voting.title
+    ).order_by(Voting.id)
+    if "term" in query:
+        rows = rows.where(Voting.term == parameter(query, "term"))
+    if "q" in query:
+        rows = ranked(rows, Voting, query["q"])
+    return page(query, rows, voting_item)
+
+
+def voting(query: dict, voting_id: str):
+    rows = Voting.select(
+        Voting.id, Voting.term, Voting.session, Voting.voting, Voting.date, Voting.title
+    ).where(Voting.id == integer("voting", voting_id)).tuples()
+    for row in rows:
+        return voting_item(*row)
+    raise ApiError(404, f"voting {voting_id} not found")
+
+
+def voting_ballots(query: dict, voting_id: str):
+    rows = Ballot \
+        .select(Ballot.delegate, Ballot.group, Ballot.result) \
+        .where(Ballot.voting == integer("voting", voting_id)) \
+        .order_by(Ballot.delegate)
+    return page(
+        query, rows,
+        lambda delegate, group, result: dict(delegate=delegate, group=group, result=result)
+    )
+
+
+def delegate_ballots(query: dict, delegate_id: str):
+    rows = Ballot \
+        .select(Voting.id, Voting.term, Voting.date, Voting.title, Ballot.group, Ballot.result) \
+        .join(Voting) \
+        .where(Ballot.delegate == integer("delegate", delegate_id)) \
+        .order_by(Voting.id)
+    return page(
+        query, rows,
+        lambda voting_id, term, date, title, group, result: dict(
+            voting=voting_id, term=term, date=str(date), title=title, group=group, result=result
+        )
+    )
+
+
+def parties():
+    return import_file(Analyses / "parties.py")
+
+
+PartyAggregates = {
+    "genders": ("party_genders", ["party", "gender", "count"]),
+    "titles": ("party_titles", ["party", "title", "count"]),
+    "results": ("group_results", ["group", "result", "count"]),
+}
+# the query cache behind the aggregates and its data version are not thread safe
+cache_lock = threading.Lock()
+
+
+def party_aggregates(query: dict, aggregate: str):
+    if aggregate not in PartyAggregates:
+        raise ApiError(404, f"unknown aggregate {aggregate}")
+    fn, fields = PartyAggregates[aggregate]
+    with cache_lock:
+        module = parties()
+        term = parameter(query, "term") or module.latest_term()
+        rows = getattr(module, fn)(term)
+    return dict(term=term, items=[dict(zip(fields, row)) for row in rows])
+
+
+Routes = [
+    (re.compile(r"/votings"), votings),
+    (re.compile(r"/votings/(\d+)"), voting),
+    (re.compile(r"/votings/(\d+)/ballots"), voting_ballots),
+    (re.compile(r"/delegates/(\d+)/ballots"), delegate_ballots),
+    (re.compile(r"/parties/(\w+)"), party_aggregates),
+]
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, which would wait for delayed acks
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_response(self, code, message=None):
+        self.responded = True
+        super().send_response(code, message)
+
+    def do_GET(self):
+        self.responded = False
+        try:
+            self.dispatch()
+        except Exception:
+            # the error is returned if nothing was sent yet, a response that
+            # failed halfway is cut off by closing the connection
+            traceback.print_exc()
+            if self.responded:
+                self.close_connection = True
+            else:
+                self.send_json(500, dict(error="internal error"))
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        for pattern, endpoint in Routes:
+            match = pattern.fullmatch(url.path)
+            if match:
+                break
+        else:
+            self.send_json(404, dict(error=f"{url.path} not found"))
+            return
+
+        with self.server.connection():
+            # responses only change with the data, so the data version
+            # and the requested url identify them, the version is read
+            # once and the cached aggregates are keyed by it as well
+            version = self.server.data_version()
+            etag = '"{}"'.format(hashlib.sha256(
+                f"{version}\n{self.path}".encode()
+            ).hexdigest()[:32])
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            try:
+                with cache.pin(version):
+                    result = endpoint(query, *match.groups())
+            except ApiError as error:
+                self.send_json(error.status, dict(error=str(error)))
+                return
+            if isinstance(result, Page):
+                self.send_page(result, url.path, query, etag)
+            else:
+                self.send_json(200, result, etag)
+
+    def send_json(self, status: int, document: dict, etag=None):
+        body = json.dumps(document, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_headers(etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_headers(self, etag):
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+
+    def send_page(self, page: Page, path: str, query: dict, etag: str):
+        # items are written in chunks while the rows are read from the cursor
+        self.send_response(200)
+        self.send_headers(etag)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        buffer = ['{"items": [']
+        size = 0
+        for number, item in enumerate(page):
+            buffer.append(("," if number else "") + json.dumps(item, ensure_ascii=False))
+            size += len(buffer[-1])
+            if size >= ChunkSize:
+                self.write_chunk("".join(buffer))
+                buffer, size = [], 0
+        following = None
+        if page.more:
+            following = f"{path}?" + urlencode(dict(query, offset=page.offset + page.limit, limit=page.limit))
+        buffer.append(f'], "offset": {page.offset}, "next": {json.dumps(following)}}}')
+        self.write_chunk("".join(buffer))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+class ApiServer(ThreadingHTTPServer):
+    # serves the database read only through a pool of connections,
+    # requests wait for a free connection
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, connections=Connections, verbose=False):
+        super().__init__((host, port), ApiHandler)
+        self.verbose = verbose
+        self.database = PooledSqliteDatabase(
+            Db.absolute().as_uri() + "?mode=ro",
+            uri=True,
+            max_connections=connections,
+            stale_timeout=300,
+            check_same_thread=False,
+            pragmas={"cache_size": -16000, "mmap_size": 268435456},
+        )
+        self.database.bind(Tables)
+        self.slots = threading.BoundedSemaphore(connections)
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            self.database.connect(reuse_if_open=True)
+            try:
+                yield
+            finally:
+                self.database.close()
+
+    def data_version(self) -> str:
+        with cache_lock:
+            return cache.data_version()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
+        self.database.close_all()
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--host", default="127.0.0.1")
+    arguments.add_argument("--port", type=int, default=8000)
+    arguments.add_argument("--connections", type=int, default=Connections)
+    arguments.add_argument("--verbose", action="store_true")
+    args = arguments.parse_args()
+
+    server = ApiServer(args.host, args.port, args.connections, args.verbose)
+    print(f"serving {Db} on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
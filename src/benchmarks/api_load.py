@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import http.client
+from pathlib import Path
+from collections import Counter
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from api import ApiServer
+from db import database, Voting, Delegate
+from benchmarks import corpus
+from benchmarks.suite import quiet
+
+
+def request_paths():
+    with database():
+        voting_ids = [voting.id for voting in Voting.select(Voting.id)]
+        delegate_ids = [delegate.id for delegate in Delegate.select(Delegate.id)]
+        terms = sorted({voting.term for voting in Voting.select(Voting.term)})
+    return [
+        "/votings?limit=100",
+        *(f"/votings?term={term}" for term in terms),
+        *(f"/votings/{voting_id}" for voting_id in voting_ids),
+        *(f"/votings/{voting_id}/ballots?limit=1000" for voting_id in voting_ids),
+        *(f"/delegates/{delegate_id}/ballots" for delegate_id in delegate_ids),
+        "/parties/genders", "/parties/titles", "/parties/results",
+    ]
+
+
+class Client(threading.Thread):
+    # requests random paths over one keep-alive connection until the deadline,
+    # revalidating with the last ETag of a path if asked to
+    def __init__(self, server: ApiServer, paths: list, deadline: float, revalidate: bool, seed: int):
+        super().__init__(daemon=True)
+        self.connection = http.client.HTTPConnection(*server.server_address)
+        self.paths = paths
+        self.deadline = deadline
+        self.revalidate = revalidate
+        self.rnd = random.Random(seed)
+        self.etags = {}
+        self.latencies = []
+        self.statuses = Counter()
+        self.bytes = 0
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            path = self.rnd.choice(self.paths)
+            headers = {}
+            if self.revalidate and path in self.etags:
+                headers["If-None-Match"] = self.etags[path]
+            start = time.perf_counter()
+            self.connection.request("GET", path, headers=headers)
+            response = self.connection.getresponse()
+            body = response.read()
+            self.latencies.append(time.perf_counter() - start)
+            self.statuses[response.status] += 1
+            self.bytes += len(body)
+            if response.getheader("ETag"):
+                self.etags[path] = response.getheader("ETag")
+        self.connection.close()
+
+
+def load_test(paths: list, clients: int, seconds: float, connections: int, revalidate: bool):
+    with ApiServer(connections=connections) as server:
+        deadline = time.perf_counter() + seconds
+        threads = [
+            Client(server, paths, deadline, revalidate, seed)
+            for seed in range(clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for thread in threads for latency in thread.latencies)
+    statuses = sum((thread.statuses for thread in threads), Counter())
+    transferred = sum(thread.bytes for thread in threads)
+    print(
+        f"{clients} clients, {connections} connections"
+        f"{', revalidating' if revalidate else ''}: "
+        f"{len(latencies) / elapsed:.0f} requests/s, "
+        f"{transferred / elapsed / 1e6:.1f} MB/s, statuses {dict(statuses)}",
+        flush=True
+    )
+    for percentile in [50, 95, 99]:
+        index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+        print(f"  p{percentile}: {latencies[index] * 1000:.2f}ms", flush=True)
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--terms", type=int, default=2)
+    arguments.add_argument("--delegates", type=int, default=300)
+    arguments.add_argument("--votings", type=int, default=20)
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--clients", type=int, default=8)
+    arguments.add_argument("--connections", type=int, default=8)
+    arguments.add_argument("--seconds", type=float, default=10)
+    args = arguments.parse_args()
+
+    workspace = Path(tempfile.mkdtemp())
+    source = Path.cwd()
+    os.chdir(str(workspace))
+    try:
+        with quiet():
+            corpus.build_database(args.terms, args.delegates, args.votings, seed=args.seed)
+        paths = request_paths()
+        for revalidate in [False, True]:
+            load_test(paths, args.clients, args.seconds, args.connections, revalidate)
+    finally:
+        os.chdir(str(source))
+        shutil.rmtree(str(workspace))
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import rollup
+from db import Db, database
+from benchmarks import corpus
+from benchmarks.suite import quiet
+
+# the ballot table as it was before group and result were dictionary encoded
+LegacyLayout = """
+CREATE TABLE ballot_text (
+    id INTEGER NOT NULL PRIMARY KEY,
+    voting_id INTEGER NOT NULL REFERENCES voting (id),
+    delegate_id INTEGER NOT NULL REFERENCES delegate (id),
+    "group" TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+INSERT INTO ballot_text (voting_id, delegate_id, "group", result)
+SELECT b.voting_id, b.delegate_id, g.name, r.name FROM ballot b
+JOIN ballotgroup g ON g.id = b.group_id
+JOIN ballotresult r ON r.id = b.result_id
+ORDER BY b.voting_id, b.delegate_id;
+DROP TABLE ballot;
+DROP TABLE ballotgroup;
+DROP TABLE ballotresult;
+ALTER TABLE ballot_text RENAME TO ballot;
+CREATE INDEX ballot_voting_id_group_result ON ballot (voting_id, "group", result);
+CREATE INDEX ballot_delegate_id_voting_id ON ballot (delegate_id, voting_id);
+ANALYZE;
+"""
+
+LegacyQueries = {
+    "group results": (
+        'SELECT v.term, b."group", b.result, COUNT(b.id) FROM ballot b '
+        'JOIN voting v ON v.id = b.voting_id GROUP BY v.term, b."group", b.result'
+    ),
+    "voting tallies": (
+        'SELECT b.voting_id, b."group", b.result, COUNT(b.id) FROM ballot b '
+        'JOIN voting v ON v.id = b.voting_id GROUP BY b.voting_id, b."group", b.result'
+    ),
+    "ballots of a voting": (
+        'SELECT delegate_id, "group", result FROM ballot WHERE voting_id = ? ORDER BY delegate_id'
+    ),
+    "ballots of a delegate": (
+        'SELECT voting_id, "group", result FROM ballot WHERE delegate_id = ? ORDER BY voting_id'
+    ),
+}
+
+
+def compact_queries():
+    # the rollup queries as the pipeline runs them
+    with database():
+        return {
+            "group results": rollup.group_results().sql()[0],
+            "voting tallies": rollup.voting_tallies().sql()[0],
+            "ballots of a voting": (
+                "SELECT b.delegate_id, g.name, r.name FROM ballot b "
+                "JOIN ballotgroup g ON g.id = b.group_id JOIN ballotresult r ON r.id = b.result_id "
+                "WHERE b.voting_id = ? ORDER BY b.delegate_id"
+            ),
+            "ballots of a delegate": (
+                "SELECT b.voting_id, g.name, r.name FROM ballot b "
+                "JOIN ballotgroup g ON g.id = b.group_id JOIN ballotresult r ON r.id = b.result_id "
+                "WHERE b.delegate_id = ? ORDER BY b.voting_id"
+            ),
+        }
+
+
+def vacuum(path: Path) -> int:
+    connection = sqlite3.connect(str(path))
+    connection.execute("PRAGMA journal_mode = DELETE")
+    connection.execute("VACUUM")
+    connection.close()
+    return path.stat().st_size
+
+
+def time_queries(path: Path, queries: dict, repeat: int) -> dict:
+    connection = sqlite3.connect(str(path))
+    voting_id, delegate_id = connection.execute(
+        "SELECT voting_id, delegate_id FROM ballot LIMIT 1"
+    ).fetchone()
+    parameters = {
+        "ballots of a voting": (voting_id,),
+        "ballots of a delegate": (delegate_id,),
+    }
+    seconds = {}
+    for name, sql in queries.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(sql, parameters.get(name, ())).fetchall()
+            timings.append(time.perf_counter() - start)
+        seconds[name] = sorted(timings)[len(timings) // 2]
+    connection.close()
+    return seconds
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--terms", type=int, default=2)
+    arguments.add_argument("--delegates", type=int, default=700)
+    arguments.add_argument("--votings", type=int, default=100)
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--repeat", type=int, default=11)
+    args = arguments.parse_args()
+
+    workspace = Path(tempfile.mkdtemp())
+    source = Path.cwd()
+    os.chdir(str(workspace))
+    try:
+        with quiet():
+            corpus.build_database(args.terms, args.delegates, args.votings, seed=args.seed)
+        queries = compact_queries()
+        legacy = Db.with_name("legacy.sqlite")
+        shutil.copyfile(str(Db), str(legacy))
+        connection = sqlite3.connect(str(legacy))
+        connection.executescript(LegacyLayout)
+        connection.close()
+
+        sizes = dict(text=vacuum(legacy), compact=vacuum(Db))
+        times = dict(
+            text=time_queries(legacy, LegacyQueries, args.repeat),
+            compact=time_queries(Db, queries, args.repeat),
+        )
+    finally:
+        os.chdir(str(source))
+        shutil.rmtree(str(workspace))
+
+    print(f"{'':<24} {'text':>10} {'compact':>10} {'ratio':>7}")
+    print(
+        f"{'database size (MB)':<24} {sizes['text'] / 1e6:>10.2f} "
+        f"{sizes['compact'] / 1e6:>10.2f} {sizes['compact'] / sizes['text']:>6.2f}x"
+    )
+    for name in LegacyQueries:
+        before, after = times["text"][name], times["compact"][name]
+        print(
+            f"{name + ' (ms)':<24} {before * 1000:>10.2f} {after * 1000:>10.2f} "
+            f"{after / max(before, 1e-9):>6.2f}x"
+        )
@@ -0,0 +1,259 @@
+import sys
+import random
+import shutil
+import zipfile
+import argparse
+from pathlib import Path
+from xml.sax.saxutils import escape
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import crawler
+import parser
+import rollup
+from db import database, create_indexes, BatchWriter
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+Groups = {
+    "CDU/CSU": "CDU",
+    "SPD": "SPD",
+    "FDP": "FDP",
+    "BÜNDNIS 90/DIE GRÜNEN": "GRÜNE",
+    "DIE LINKE.": "DIE LINKE.",
+    "AfD": "AfD",
+}
+FirstNames = ["Hans", "Anna", "Peter", "Maria", "Michael", "Eva", "Jürgen", "Sevim", "Karl", "Ute"]
+LastNames = ["Müller", "Schmidt", "Weiß", "Link", "Özoğuz", "Kauder", "Brugger", "Becker", "Wagner", "Hoffmann"]
+Results = ["ja", "nein", "Enthaltung", "ungültig", "nichtabgegeben"]
+SheetHeaders = [
+    "Wahlperiode", "Sitzungnr", "Abstimmnr", "Fraktion/Gruppe", "Name", "Vorname", "Titel",
+    *Results, "Bezeichnung", "Bemerkung",
+]
+FirstTerm = 14
+
+SpreadsheetNamespace = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RelationshipsNamespace = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PackageRelationshipsNamespace = "http://schemas.openxmlformats.org/package/2006/relationships"
+ContentTypes = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>"""
+PackageRelationships = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="{PackageRelationshipsNamespace}">
+<Relationship Id="rId1" Type="{RelationshipsNamespace}/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+Workbook = f"""<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="{SpreadsheetNamespace}" xmlns:r="{RelationshipsNamespace}">
+<sheets><sheet name="Tabelle1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+WorkbookRelationships = f"""<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="{PackageRelationshipsNamespace}">
+<Relationship Id="rId1" Type="{RelationshipsNamespace}/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="{RelationshipsNamespace}/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>"""
+
+
+def column_letters(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def write_xlsx(path: Path, rows):
+    strings = {}
+    sheet_rows = []
+    for row_number, row in enumerate(rows, 1):
+        cells = []
+        for column, value in enumerate(row):
+            reference = f"{column_letters(column)}{row_number}"
+            if isinstance(value, str):
+                index = strings.setdefault(value, len(strings))
+                cells.append(f'<c r="{reference}" t="s"><v>{index}</v></c>')
+            elif value is not None:
+                cells.append(f'<c r="{reference}"><v>{value}</v></c>')
+        sheet_rows.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+
+    with zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", ContentTypes)
+        archive.writestr("_rels/.rels", PackageRelationships)
+        archive.writestr("xl/workbook.xml", Workbook)
+        archive.writestr("xl/_rels/workbook.xml.rels", WorkbookRelationships)
+        archive.writestr(
+            "xl/worksheets/sheet1.xml",
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<worksheet xmlns="{SpreadsheetNamespace}"><sheetData>'
+            + "".join(sheet_rows)
+            + "</sheetData></worksheet>"
+        )
+        archive.writestr(
+            "xl/sharedStrings.xml",
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<sst xmlns="{SpreadsheetNamespace}" count="{len(strings)}" uniqueCount="{len(strings)}">'
+            + "".join(f"<si><t>{escape(string)}</t></si>" for string in strings)
+            + "</sst>"
+        )
+
+
+def write_xls(path: Path, rows):
+    workbook = xlwt.Workbook(encoding="utf-8")
+    sheet = workbook.add_sheet("Tabelle1")
+    for row_number, row in enumerate(rows):
+        for column, value in enumerate(row):
+            if value is not None:
+                sheet.write(row_number, column, value)
+    workbook.save(str(path))
+
+
+class SyntheticDelegate:
+    def __init__(self, delegate_id: int, term: int, number: int, rnd: random.Random):
+        self.id = delegate_id
+        self.term = term
+        self.first_name = rnd.choice(FirstNames)
+        # the number keeps names unique, no name may contain another one
+        self.last_name = f"{rnd.choice(LastNames)}{term}x{number:05d}"
+        self.title = "Dr." if rnd.random() < 0.2 else None
+        self.site = "(Heilbronn)" if rnd.random() < 0.05 else None
+        self.group = rnd.choice(list(Groups))
+        self.gender = rnd.choice(["männlich", "weiblich"])
+        self.serving = rnd.random() > 0.05
+
+    @property
+    def full_name(self) -> str:
+        return " ".join(
+            part for part in [self.title, self.first_name, self.last_name, self.site] if part
+        )
+
+    def xml(self) -> str:
+        return (
+            f"<MDB><ID>{self.id:08d}</ID>"
+            "<NAMEN><NAME>"
+            f"<NACHNAME>{escape(self.last_name)}</NACHNAME>"
+            f"<VORNAME>{escape(self.first_name)}</VORNAME>"
+            f"<ORTSZUSATZ>{self.site or ''}</ORTSZUSATZ>"
+            "<ADEL></ADEL><PRAEFIX></PRAEFIX>"
+            f"<ANREDE_TITEL>{self.title or ''}</ANREDE_TITEL>"
+            f"<AKAD_TITEL>{self.title or ''}</AKAD_TITEL>"
+            "<HISTORIE_VON>01.01.1990</HISTORIE_VON><HISTORIE_BIS></HISTORIE_BIS>"
+            "</NAME></NAMEN>"
+            "<BIOGRAFISCHE_ANGABEN>"
+            "<GEBURTSDATUM>01.02.1960</GEBURTSDATUM><GEBURTSORT>Berlin</GEBURTSORT>"
+            "<GEBURTSLAND></GEBURTSLAND><STERBEDATUM></STERBEDATUM>"
+            f"<GESCHLECHT>{self.gender}</GESCHLECHT>"
+            "<FAMILIENSTAND>verheiratet</FAMILIENSTAND><RELIGION></RELIGION>"
+            "<BERUF>Jurist</BERUF>"
+            f"<PARTEI_KURZ>{escape(Groups[self.group])}</PARTEI_KURZ>"
+            "<VITA_KURZ></VITA_KURZ><VEROEFFENTLICHUNGSPFLICHTIGES></VEROEFFENTLICHUNGSPFLICHTIGES>"
+            "</BIOGRAFISCHE_ANGABEN>"
+            "<WAHLPERIODEN><WAHLPERIODE>"
+            f"<WP>{self.term}</WP>"
+            "<MDBWP_VON>01.01.1990</MDBWP_VON>"
+            f"<MDBWP_BIS>{'' if self.serving else '01.01.1991'}</MDBWP_BIS>"
+            "<WKR_NUMMER></WKR_NUMMER><WKR_NAME></WKR_NAME><WKR_LAND></WKR_LAND>"
+            "<LISTE>BY</LISTE><MANDATSART>Landesliste</MANDATSART>"
+            "<INSTITUTIONEN></INSTITUTIONEN>"
+            "</WAHLPERIODE></WAHLPERIODEN>"
+            "</MDB>"
+        )
+
+    def sheet_name(self, rnd: random.Random) -> str:
+        # sheets sometimes drop the title or site of a name
+        if rnd.random() < 0.1:
+            return " ".join(part for part in [self.first_name, self.last_name] if part)
+        return self.full_name
+
+
+def write_delegates(path: Path, delegates):
+    document = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        "<DOCUMENT><VERSION>1</VERSION>"
+        + "".join(delegate.xml() for delegate in delegates)
+        + "</DOCUMENT>"
+    )
+    with zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(parser.DelegatesMember, document)
+        archive.writestr("MDB_STAMMDATEN.DTD", "")
+
+
+def generate(folder: Path, terms=2, delegates=100, votings=10, sheet_format="xlsx", seed=0):
+    """Write a delegates zip and voting sheets as crawled into the data folder."""
+    if sheet_format == "xls" and xlwt is None:
+        raise Exception("writing .xls sheets requires xlwt")
+    write_sheet = write_xls if sheet_format == "xls" else write_xlsx
+
+    rnd = random.Random(seed)
+    votings_folder = folder / "votings"
+    delegates_folder = folder / "delegates"
+    votings_folder.mkdir(parents=True, exist_ok=True)
+    delegates_folder.mkdir(parents=True, exist_ok=True)
+
+    members = {
+        term: [
+            SyntheticDelegate(
+                11000000 + term * 100000 + number, term, number, rnd
+            )
+            for number in range(delegates)
+        ]
+        for term in range(FirstTerm, FirstTerm + terms)
+    }
+    write_delegates(
+        delegates_folder / crawler.DelegatesReferenceDataFilename,
+        [delegate for term_members in members.values() for delegate in term_members]
+    )
+
+    for term, term_members in members.items():
+        for number in range(votings):
+            rows = [SheetHeaders]
+            for delegate in term_members:
+                results = [0] * len(Results)
+                results[rnd.randrange(len(Results))] = 1
+                rows.append([
+                    float(term), float(number // 3 + 1), float(number % 3 + 1),
+                    delegate.group, delegate.last_name, delegate.first_name,
+                    delegate.title or "", *results, delegate.sheet_name(rnd), None,
+                ])
+            voting_date = f"{1990 + term}-{number % 12 + 1:02d}-{number % 28 + 1:02d}"
+            write_sheet(
+                votings_folder / f"{voting_date}_Abstimmung {term}-{number}.{sheet_format}",
+                rows
+            )
+
+
+def build_database(terms=2, delegates=100, votings=10, seed=0):
+    """Generate a corpus and parse it into the database of the working directory."""
+    generate(Path("corpus"), terms, delegates, votings, seed=seed)
+    crawler.prepare()
+    for folder in ["votings", "delegates"]:
+        shutil.rmtree(str(crawler.DataFolder / folder))
+        shutil.copytree(str(Path("corpus", folder)), str(crawler.DataFolder / folder))
+    with database(rebuild=True), BatchWriter(upsert=True) as writer:
+        parser.parse_delegates(writer)
+        parser.parse_votings(writer)
+        writer.flush()
+        create_indexes()
+        rollup.update()
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("folder", type=Path)
+    arguments.add_argument("--terms", type=int, default=2)
+    arguments.add_argument("--delegates", type=int, default=100)
+    arguments.add_argument("--votings", type=int, default=10)
+    arguments.add_argument("--format", choices=["xlsx", "xls"], default="xlsx")
+    arguments.add_argument("--seed", type=int, default=0)
+    args = arguments.parse_args()
+
+    generate(
+        args.folder, args.terms, args.delegates, args.votings,
+        sheet_format=args.format, seed=args.seed
+    )
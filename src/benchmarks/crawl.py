@@ -0,0 +1,56 @@
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import crawler
+from benchmarks.server import StandInServer
+
+
+def crawl(server: StandInServer, destination: Path, **options):
+    votings_folder = destination / "votings"
+    delegates_folder = destination / "delegates"
+    votings_folder.mkdir(parents=True, exist_ok=True)
+    delegates_folder.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    with crawler.DownloadManifest(destination / "downloads.jsonl") as manifest:
+        crawler.Crawler(server.domain, **options) \
+            .crawl(votings_folder, delegates_folder, manifest)
+    seconds = time.perf_counter() - start
+
+    expected = {path.name for path in server.votings}
+    downloaded = {path.name for path in votings_folder.iterdir()}
+    assert downloaded == expected, expected ^ downloaded
+    print(f"crawled {len(downloaded)} votings in {seconds:.2f}s", flush=True)
+    return seconds
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("data", type=Path)
+    arguments.add_argument("--latency", type=float, default=0.05)
+    arguments.add_argument("--fail-every", type=int, default=0)
+    arguments.add_argument("--jobs", type=int, default=10)
+    arguments.add_argument("--prefetch", type=int, default=4)
+    args = arguments.parse_args()
+
+    destination = Path(tempfile.mkdtemp())
+    try:
+        with StandInServer(
+            args.data / "votings",
+            delegates=args.data / "delegates" / crawler.DelegatesReferenceDataFilename,
+            latency=args.latency,
+            fail_every=args.fail_every,
+        ) as server:
+            for run in ["initial", "repeated"]:
+                print(f"{run} crawl:")
+                crawl(
+                    server, destination,
+                    max_workers=args.jobs, prefetch=args.prefetch, backoff=0.01
+                )
+    finally:
+        shutil.rmtree(str(destination))
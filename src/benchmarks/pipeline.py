@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import crawler
+import parser
+from pipeline import Pipeline
+from db import database, BatchWriter, Voting
+from benchmarks import corpus
+from benchmarks.crawl import crawl
+from benchmarks.server import StandInServer
+from benchmarks.suite import quiet
+
+
+def staged(server: StandInServer, jobs: int, parsers: int):
+    # crawler.py followed by parser.py
+    crawl(server, crawler.DataFolder, max_workers=jobs)
+    with database(create=True), BatchWriter(upsert=True) as writer:
+        parser.parse_delegates(writer)
+        parser.parse_votings(writer, jobs=parsers)
+
+
+def streamed(server: StandInServer, jobs: int, parsers: int, queue_size: int):
+    with crawler.DownloadManifest(crawler.DownloadManifestPath) as manifest, \
+            database(create=True), BatchWriter(upsert=True) as writer, \
+            Pipeline(manifest, server.domain, jobs, parsers, queue_size) as pipeline:
+        pipeline.run(writer)
+
+
+def votings():
+    with database():
+        return list(Voting.select(Voting.id, Voting.title).order_by(Voting.id).tuples())
+
+
+def measure(name: str, workspace: Path, fn, *args):
+    workspace.mkdir()
+    source = Path.cwd()
+    os.chdir(str(workspace))
+    try:
+        crawler.prepare()
+        start = time.perf_counter()
+        with quiet():
+            fn(*args)
+        seconds = time.perf_counter() - start
+        print(f"{name}: {seconds:.2f}s", flush=True)
+        return seconds, votings()
+    finally:
+        os.chdir(str(source))
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--terms", type=int, default=2)
+    arguments.add_argument("--delegates", type=int, default=300)
+    arguments.add_argument("--votings", type=int, default=40)
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--latency", type=float, default=0.2)
+    arguments.add_argument("--jobs", type=int, default=4)
+    arguments.add_argument("--parsers", type=int, default=2)
+    arguments.add_argument("--queue-size", type=int, default=32)
+    args = arguments.parse_args()
+
+    workspace = Path(tempfile.mkdtemp())
+    try:
+        with quiet():
+            corpus.generate(workspace / "corpus", args.terms, args.delegates, args.votings, seed=args.seed)
+        with StandInServer(
+            workspace / "corpus" / "votings",
+            delegates=workspace / "corpus" / "delegates" / crawler.DelegatesReferenceDataFilename,
+            latency=args.latency,
+        ) as server:
+            staged_seconds, staged_votings = measure(
+                "crawl then parse", workspace / "staged", staged,
+                server, args.jobs, args.parsers
+            )
+            streamed_seconds, streamed_votings = measure(
+                "pipeline", workspace / "streamed", streamed,
+                server, args.jobs, args.parsers, args.queue_size
+            )
+        assert staged_votings == streamed_votings, "voting ids differ"
+        print(f"speedup: {staged_seconds / streamed_seconds:.2f}x, same voting ids", flush=True)
+    finally:
+        shutil.rmtree(str(workspace))
@@ -0,0 +1,120 @@
+import re
+import time
+import html
+import hashlib
+import threading
+from pathlib import Path
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import crawler
+
+VotingsListPath = urlsplit(
+    crawler.VotingsListUrl.format(domain="", limit=0, offset=0)
+).path
+VotingFilePattern = re.compile(r"(\d\d\d\d)-(\d\d)-(\d\d)_(.+)\.xlsx?")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_every and server.requests % server.fail_every == 0
+        if fail:
+            self.send_error(503)
+            return
+
+        url = urlsplit(self.path)
+        if url.path == VotingsListPath:
+            query = parse_qs(url.query)
+            offset = int(query["offset"][0])
+            limit = int(query["limit"][0])
+            self.send_html(server.votings_list(offset, limit))
+        elif url.path == crawler.DelegatesReferenceDataPath and server.delegates:
+            self.send_file(server.delegates)
+        elif url.path.startswith("/files/"):
+            path = server.votings_folder / Path(unquote(url.path)).name
+            if path.is_file():
+                self.send_file(path)
+            else:
+                self.send_error(404)
+        else:
+            self.send_error(404)
+
+    def send_html(self, text: str):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, path: Path):
+        body = path.read_bytes()
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header(
+            "Last-Modified", formatdate(path.stat().st_mtime, usegmt=True)
+        )
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInServer(ThreadingHTTPServer):
+    # serves the votings list and files of a local corpus like bundestag.de
+    daemon_threads = True
+
+    def __init__(self, votings_folder: Path, delegates: Path = None, port=0, latency=0.0, fail_every=0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.votings_folder = Path(votings_folder)
+        self.delegates = delegates
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.votings = sorted(
+            (path for path in self.votings_folder.iterdir()
+             if VotingFilePattern.match(path.name)),
+            reverse=True
+        )
+
+    @property
+    def domain(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def votings_list(self, offset: int, limit: int) -> str:
+        page = self.votings[offset:offset + limit]
+        if not page:
+            return "<h3>Keine Ergebnisse</h3>"
+        entries = []
+        for path in page:
+            year, month, day, title = VotingFilePattern.match(path.name).groups()
+            entries.append(
+                '<div class="bt-documents-description">'
+                f"<p><strong>{day}.{month}.{year}: {html.escape(title)}</strong></p>"
+                f'<ul><li><a href="/files/{quote(path.name)}">XLSX</a></li></ul>'
+                "</div>"
+            )
+        return "<html><body>" + "".join(entries) + "</body></html>"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
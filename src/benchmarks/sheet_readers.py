@@ -0,0 +1,48 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import xlrd
+import sheets
+import parser
+
+
+def read_with_xlrd(path: Path):
+    sheet = xlrd.open_workbook(str(path)).sheet_by_index(0)
+    return [[cell.value for cell in row] for row in sheet.get_rows()]
+
+
+def read_with_sheets(path: Path):
+    return list(sheets.read_rows(path))
+
+
+def measure(reader, paths):
+    start = time.perf_counter()
+    rows = [reader(path) for path in paths]
+    return time.perf_counter() - start, rows
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("votings", type=Path, nargs="?", default=parser.VotingsFolder)
+    args = arguments.parse_args()
+
+    for suffix in [".xlsx", ".xls"]:
+        paths = sorted(
+            path for path in args.votings.iterdir() if path.suffix == suffix
+        )
+        if not paths:
+            continue
+        xlrd_seconds, xlrd_rows = measure(read_with_xlrd, paths)
+        sheets_seconds, sheets_rows = measure(read_with_sheets, paths)
+        for path, expected, actual in zip(paths, xlrd_rows, sheets_rows):
+            expected = list(parser.mapped(iter(expected)))
+            actual = list(parser.mapped(iter(actual)))
+            assert expected == actual, path
+        print(
+            f"{suffix}: {len(paths)} files, xlrd {xlrd_seconds:.2f}s, "
+            f"sheets {sheets_seconds:.2f}s "
+            f"({xlrd_seconds / sheets_seconds:.1f}x)"
+        )
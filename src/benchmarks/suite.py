@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager, redirect_stdout
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import crawler
+import parser
+import rollup
+import matrix
+import generator
+from db import database, create_indexes, BatchWriter
+from cache import cache
+from ext.pygal_sphinx_directives import ChartSize, render_svg
+from benchmarks import corpus
+from benchmarks.crawl import crawl
+from benchmarks.server import StandInServer
+
+Source = Path(__file__).parent.parent
+
+
+@contextmanager
+def quiet():
+    with open(os.devnull, mode="w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+class Timings:
+    def __init__(self):
+        self.seconds = {}
+
+    def measure(self, name: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        with quiet():
+            value = fn(*args, **kwargs)
+        self.seconds[name] = round(time.perf_counter() - start, 4)
+        print(f"{name}: {self.seconds[name]:.3f}s", flush=True)
+        return value
+
+
+def benchmark_crawl(timings: Timings, corpus_folder: Path, latency: float, jobs: int):
+    with StandInServer(
+        corpus_folder / "votings",
+        delegates=corpus_folder / "delegates" / crawler.DelegatesReferenceDataFilename,
+        latency=latency,
+    ) as server:
+        timings.measure(
+            "crawl.votings", lambda: list(crawler.Crawler(server.domain).votings())
+        )
+        for run in ["initial", "repeated"]:
+            timings.measure(
+                f"crawl.{run}", crawl, server, crawler.DataFolder, max_workers=jobs
+            )
+
+
+def benchmark_parse(timings: Timings, jobs: int):
+    with database(rebuild=True), BatchWriter(upsert=True) as writer:
+        timings.measure("parse.delegates", parser.parse_delegates, writer)
+        timings.measure("parse.votings", parser.parse_votings, writer, jobs=jobs)
+        writer.flush()
+        timings.measure("parse.indexes", create_indexes)
+        timings.measure("parse.rollup", rollup.update)
+        timings.measure("parse.matrix", matrix.export)
+
+
+def benchmark_analyses(timings: Timings):
+    with database():
+        for analysis in generator.iter_analyses():
+            module = generator.import_file(analysis)
+            for fn, args in generator.plotted_functions(module):
+                name = f"{analysis.stem}.{fn}" + "".join(f".{arg}" for arg in args)
+                cache.entries.clear()
+                chart = timings.measure(
+                    f"analysis.{name}", getattr(module, fn), *args
+                )
+                timings.measure(f"render.{name}", render_svg, chart, *ChartSize)
+
+
+def benchmark_generator(timings: Timings, jobs: int):
+    # the generator reads its configuration from src relative to the working directory
+    Path("src").symlink_to(Source.absolute(), target_is_directory=True)
+    command = [sys.executable, "src/generator.py", "--jobs", str(jobs)]
+    for run, options in [("full", []), ("incremental", ["--incremental"])]:
+        timings.measure(
+            f"generate.{run}", subprocess.run, command + options,
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=str(Source),
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, results: dict):
+    print(f"{'stage':<40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, seconds in results["seconds"].items():
+        before = baseline["seconds"].get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>10} {seconds:>10.3f} {'-':>7}")
+        else:
+            print(
+                f"{name:<40} {before:>10.3f} {seconds:>10.3f} "
+                f"{seconds / max(before, 1e-9):>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--terms", type=int, default=2)
+    arguments.add_argument("--delegates", type=int, default=300)
+    arguments.add_argument("--votings", type=int, default=20)
+    arguments.add_argument("--format", choices=["xlsx", "xls"], default="xlsx")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--latency", type=float, default=0.01)
+    arguments.add_argument("--jobs", type=int, default=4)
+    arguments.add_argument("--skip", action="append", default=[],
+                           choices=["crawl", "parse", "analyses", "generator"])
+    arguments.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    arguments.add_argument("--baseline", type=Path)
+    args = arguments.parse_args()
+    output = args.output.absolute()
+    baseline = args.baseline.absolute() if args.baseline else None
+
+    workspace = Path(tempfile.mkdtemp())
+    os.chdir(str(workspace))
+    try:
+        timings = Timings()
+        timings.measure(
+            "corpus", corpus.generate, Path("corpus"), args.terms, args.delegates,
+            args.votings, sheet_format=args.format, seed=args.seed
+        )
+        crawler.prepare()
+        if "crawl" in args.skip:
+            for folder in ["votings", "delegates"]:
+                shutil.rmtree(str(crawler.DataFolder / folder))
+                shutil.copytree(str(Path("corpus", folder)), str(crawler.DataFolder / folder))
+        else:
+            benchmark_crawl(timings, Path("corpus"), args.latency, args.jobs)
+        if "parse" not in args.skip:
+            benchmark_parse(timings, args.jobs)
+        if "analyses" not in args.skip:
+            benchmark_analyses(timings)
+        if "generator" not in args.skip:
+            benchmark_generator(timings, args.jobs)
+    finally:
+        os.chdir(str(Source))
+        shutil.rmtree(str(workspace))
+
+    results = dict(
+        commit=commit(),
+        python=platform.python_version(),
+        corpus=dict(
+            terms=args.terms, delegates=args.delegates, votings=args.votings,
+            format=args.format, seed=args.seed,
+        ),
+        seconds=timings.seconds,
+    )
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+    if baseline is not None:
+        compare(json.loads(baseline.read_text()), results)
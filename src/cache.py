@@ -0,0 +1,159 @@
+import os
+import sys
+import pickle
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from db import db, fingerprint
+
+CacheFolder = Path("data/cache")
+SourceFolder = Path(__file__).resolve().parent
+
+
+def file_stat(path: Path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class QueryCache:
+    # results are keyed by function, arguments and data version,
+    # kept in memory (LRU) and optionally pickled into a folder
+    def __init__(self, maxsize=256, folder: Path = None):
+        self.maxsize = maxsize
+        self.folder = folder
+        self.entries = OrderedDict()
+        self.stats = Counter()
+        self.version = None
+        self.version_stat = None
+        self.pinned = threading.local()
+
+    @contextmanager
+    def pin(self, version: str):
+        # results are keyed by the given version within the current thread,
+        # e.g. the version a response is tagged with
+        self.pinned.version = version
+        try:
+            yield
+        finally:
+            self.pinned.version = None
+
+    def data_version(self) -> str:
+        version = getattr(self.pinned, "version", None)
+        if version is not None:
+            return version
+        # the fingerprint is only recomputed when the database files changed
+        path = Path(db.database)
+        stat = (file_stat(path), file_stat(path.with_name(path.name + "-wal")))
+        if stat != self.version_stat:
+            self.version = fingerprint()
+            self.version_stat = stat
+        return self.version
+
+    def key(self, name: str, source: str, args: tuple, kwargs: dict) -> str:
+        sha256 = hashlib.sha256()
+        for part in [name, source, repr(args), repr(sorted(kwargs.items())), self.data_version()]:
+            sha256.update(f"{part}\n".encode())
+        return sha256.hexdigest()
+
+    def get(self, key: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats["memory hits"] += 1
+            return True, self.entries[key]
+        stored = self.stored(key)
+        if stored is not None and stored.exists():
+            value = pickle.loads(stored.read_bytes())
+            self.stats["disk hits"] += 1
+            self.remember(key, value)
+            return True, value
+        self.stats["misses"] += 1
+        return False, None
+
+    def remember(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stored(self, key: str) -> Path:
+        # pickles are kept in a folder per data version
+        if self.folder is None:
+            return None
+        return self.folder / self.data_version() / f"{key}.pickle"
+
+    def put(self, key: str, value):
+        self.remember(key, value)
+        stored = self.stored(key)
+        if stored is not None:
+            self.prune(stored.parent)
+            stored.parent.mkdir(parents=True, exist_ok=True)
+            partial = stored.with_name(stored.name + ".tmp")
+            partial.write_bytes(pickle.dumps(value))
+            os.replace(str(partial), str(stored))
+
+    def prune(self, current: Path):
+        # results of older data versions can't be read anymore
+        if not self.folder.exists():
+            return
+        for path in self.folder.iterdir():
+            if path == current:
+                continue
+            if path.is_dir():
+                shutil.rmtree(str(path), ignore_errors=True)
+            else:
+                path.unlink()
+            self.stats["pruned"] += 1
+
+    def report(self):
+        hits = self.stats["memory hits"] + self.stats["disk hits"]
+        calls = hits + self.stats["misses"]
+        print(
+            f"query cache: {hits}/{calls} hits "
+            f"({self.stats['memory hits']} memory, {self.stats['disk hits']} disk), "
+            f"{self.stats['misses']} misses, {self.stats['pruned']} pruned",
+            flush=True
+        )
+
+
+cache = QueryCache()
+
+
+def source_files(fn) -> list:
+    # the defining file and the files of the modules of this repo it uses,
+    # e.g. the models and rollups an analysis queries
+    files = {Path(fn.__code__.co_filename).resolve()}
+    for value in fn.__globals__.values():
+        module = value if isinstance(value, type(sys)) \
+            else sys.modules.get(getattr(value, "__module__", None) or "")
+        path = getattr(module, "__file__", None)
+        if path is not None and SourceFolder in Path(path).resolve().parents:
+            files.add(Path(path).resolve())
+    return sorted(files)
+
+
+def cached(fn):
+    # the sources are part of the key,
+    # so edited analyses don't read stale results from disk
+    name = f"{fn.__module__}.{fn.__qualname__}"
+    sha256 = hashlib.sha256()
+    for path in source_files(fn):
+        sha256.update(path.read_bytes())
+    source = sha256.hexdigest()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = cache.key(name, source, args, kwargs)
+        hit, value = cache.get(key)
+        if not hit:
+            value = fn(*args, **kwargs)
+            cache.put(key, value)
+        return value
+
+    return wrapper
@@ -1,8 +1,12 @@
 import itertools
 import shutil
 import hashlib
-import zipfile
 import re
+import os
+import json
+import argparse
+import threading
+from collections import Counter, deque
 from datetime import date
 from typing import NamedTuple
 from pathlib import Path
@@ -10,35 +14,158 @@ from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib3.exceptions
+
+import instrumentation
+from instrumentation import stage, timer, count
 
 Domain = "https://www.bundestag.de"
 
 VotingsListUrl = "{domain}/ajax/filterlist/de/parlament/plenum/abstimmung/liste/462112-462112/h_60ffc88993d8146490048cae8be92856?limit={limit}&noFilterSet=true&offset={offset}"
 VotingsLimit = 30
 
-DelegatesReferenceDataUrl = f"{Domain}/resource/blob/472878/7d4d417dbb7f7bd44508b3dc5de08ae2/MdB-Stammdaten-data.zip"
+DelegatesReferenceDataPath = "/resource/blob/472878/7d4d417dbb7f7bd44508b3dc5de08ae2/MdB-Stammdaten-data.zip"
+DelegatesReferenceDataUrl = f"{Domain}{DelegatesReferenceDataPath}"
 DelegatesReferenceDataFilename = "delegates_reference_data.zip"
 
 DataFolder = Path("data")
 VotingsFolder = DataFolder / "votings"
 DelegatesFolder = DataFolder / "delegates"
+DownloadManifestPath = DataFolder / "downloads.jsonl"
+# seconds to connect and between received bytes
+Timeout = (10, 60)
 
 
-def make_soup(url: str):
-    with requests.get(url) as req:
+def make_soup(url: str, session=requests):
+    with session.get(url, timeout=Timeout) as req:
         assert req.status_code == 200, req
     return BeautifulSoup(req.text, 'html.parser')
 
 
-def download(url: str, destination: Path):
-    with requests.get(url, stream=True) as req:
-        with open(str(destination), mode="wb") as dest_file:
-            shutil.copyfileobj(req.raw, dest_file)
+class DownloadManifest:
+    # append-only log of finished downloads, the last entry of a file wins
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        if path.exists():
+            for line in path.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[entry["destination"]] = entry
+        self.log = open(str(path), mode="a")
+
+    def get(self, destination: Path):
+        with self.lock:
+            return self.entries.get(str(destination))
+
+    def record(self, destination: Path, **entry):
+        entry["destination"] = str(destination)
+        with self.lock:
+            self.entries[entry["destination"]] = entry
+            self.log.write(json.dumps(entry) + "\n")
+            self.log.flush()
+
+    def forget(self, destination: Path):
+        with self.lock:
+            self.entries.pop(str(destination), None)
+
+    def count(self, stat: str, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def close(self):
+        self.log.close()
+        compacted = self.path.with_name(self.path.name + ".tmp")
+        compacted.write_text(
+            "".join(json.dumps(entry) + "\n" for entry in self.entries.values())
+        )
+        os.replace(str(compacted), str(self.path))
+
+    def report(self):
+        print(
+            f"downloads: {self.stats['fetched']} fetched, "
+            f"{self.stats['skipped']} skipped, {self.stats['failed']} failed, "
+            f"{self.stats['bytes fetched']} bytes fetched, "
+            f"{self.stats['bytes saved']} bytes saved",
+            flush=True
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        self.report()
+
 
-    if req.status_code == 200:
-        print(f"downloaded {url} -> {destination.name}", flush=True)
+def download(url: str, destination: Path, manifest: DownloadManifest, revalidate=False, session=requests):
+    entry = manifest.get(destination)
+    present = entry is not None and entry["url"] == url \
+        and destination.exists() and destination.stat().st_size == entry["size"]
+    if present and not revalidate:
+        manifest.count("skipped")
+        manifest.count("bytes saved", entry["size"])
+        return False
+
+    headers = {}
+    if present and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if present and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    partial = destination.with_name(destination.name + ".part")
+    sha256 = hashlib.sha256()
+    try:
+        with timer("download"), \
+                session.get(url, stream=True, headers=headers, timeout=Timeout) as req:
+            if req.status_code == 304:
+                manifest.count("skipped")
+                manifest.count("bytes saved", entry["size"])
+                return False
+            if req.status_code != 200:
+                raise requests.HTTPError(req.status_code, response=req)
+            with open(str(partial), mode="wb") as dest_file:
+                for chunk in iter(lambda: req.raw.read(1 << 16), b""):
+                    sha256.update(chunk)
+                    dest_file.write(chunk)
+            # a connection closed early ends the body without an error
+            expected = req.headers.get("Content-Length")
+            if expected is not None and partial.stat().st_size != int(expected):
+                raise urllib3.exceptions.ProtocolError(
+                    f"received {partial.stat().st_size} of {expected} bytes"
+                )
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as error:
+        if partial.exists():
+            partial.unlink()
+        manifest.count("failed")
+        print(f"failed {url}: {error}", flush=True)
+        return False
+
+    size = partial.stat().st_size
+    manifest.count("bytes fetched", size)
+    if present and entry["sha256"] == sha256.hexdigest():
+        partial.unlink()
+        changed = False
     else:
-        print(f"failed {url}")
+        os.replace(str(partial), str(destination))
+        changed = True
+    manifest.record(
+        destination,
+        url=url,
+        etag=req.headers.get("ETag"),
+        last_modified=req.headers.get("Last-Modified"),
+        size=size,
+        sha256=sha256.hexdigest(),
+    )
+    manifest.count("fetched")
+    print(f"downloaded {url} -> {destination.name}", flush=True)
+    return changed
 
 
 class VotingResultsFile(NamedTuple):
@@ -53,81 +180,178 @@ class VotingResultsFile(NamedTuple):
     def filename(self) -> str:
         return f"{self.voting_date}_{self.title}{self._file_type()}"
 
-    def download(self, votings_folder: Path):
-        download(self.url, votings_folder / self.filename)
-
-
-def votings():
-    def sanitize(text: str):
-        missing_dates = {
-            "Bundeswehreinsatz ACTIVE ENDEAVOUR (OAE)": "19.12.2014",
-            "Bundeswehreinsatz in Afghanistan (RSM)": "19.12.2014",
-            "Änderung des Bundesdatenschutzgesetzes": "19.12.2014",
-            "Änderung des Bundesdatenschutzgesetzes - Änderungsantrag": "19.12.2014",
-        }
-        wrong_dates = {
-            "28.04.206": "28.04.2016",
-            "27.06.20130": "27.06.2013",
-        }
-
-        if text in missing_dates:
-            return f"{missing_dates[text]}: {text}"
-        for wrong_date, corecct_date in wrong_dates.items():
-            if text.startswith(wrong_date):
-                return text.replace(wrong_date, corecct_date, 1)
-        return text
-
-    for offset in itertools.count(0, VotingsLimit):
+    def download(self, votings_folder: Path, manifest: DownloadManifest, session=requests):
+        return download(
+            self.url, votings_folder / self.filename, manifest, session=session
+        )
+
+
+def sanitize(text: str):
+    missing_dates = {
+        "Bundeswehreinsatz ACTIVE ENDEAVOUR (OAE)": "19.12.2014",
+        "Bundeswehreinsatz in Afghanistan (RSM)": "19.12.2014",
+        "Änderung des Bundesdatenschutzgesetzes": "19.12.2014",
+        "Änderung des Bundesdatenschutzgesetzes - Änderungsantrag": "19.12.2014",
+    }
+    wrong_dates = {
+        "28.04.206": "28.04.2016",
+        "27.06.20130": "27.06.2013",
+    }
+
+    if text in missing_dates:
+        return f"{missing_dates[text]}: {text}"
+    for wrong_date, corecct_date in wrong_dates.items():
+        if text.startswith(wrong_date):
+            return text.replace(wrong_date, corecct_date, 1)
+    return text
+
+
+def parse_votings_list(soup, domain: str, offset: int):
+    for div in soup.find_all("div", "bt-documents-description"):
+        for link in div.find_all("a"):
+            href = link.get('href')
+            if href.endswith("xlsx") or href.endswith("xls"):
+                text = sanitize(div.p.strong.text.strip())
+                match = re.match(r"(\d\d).(\d\d).(\d\d\d\d): (.*)", text)
+
+                if match is None:
+                    raise Exception(text, offset)
+
+                voting_date = date(
+                    int(match.group(3)), int(
+                        match.group(2)), int(match.group(1))
+                )
+                title = match.group(4)
+
+                yield VotingResultsFile(f"{domain}{href}", voting_date, title)
+                break
+
+
+class Crawler:
+    def __init__(self, domain=Domain, max_workers=10, prefetch=4, retries=5, backoff=0.5):
+        self.domain = domain
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_workers + prefetch,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def votings_list_page(self, offset: int):
         url = VotingsListUrl.format(
-            domain=Domain, offset=offset, limit=VotingsLimit
+            domain=self.domain, offset=offset, limit=VotingsLimit
         )
-        soup = make_soup(url)
+        with timer("listing page"):
+            soup = make_soup(url, session=self.session)
+        count("listing pages")
         if soup.h3:
-            return
+            return None
+        return list(parse_votings_list(soup, self.domain, offset))
 
-        for div in soup.find_all("div", "bt-documents-description"):
-            for link in div.find_all("a"):
-                href = link.get('href')
-                if href.endswith("xlsx") or href.endswith("xls"):
-                    text = sanitize(div.p.strong.text.strip())
-                    match = re.match(r"(\d\d).(\d\d).(\d\d\d\d): (.*)", text)
+    def votings(self):
+        # listing pages are fetched speculatively ahead,
+        # until the first page without votings is reached
+        offsets = itertools.count(0, VotingsLimit)
+        with ThreadPoolExecutor(max_workers=self.prefetch) as listing:
+            pages = deque(
+                listing.submit(self.votings_list_page, next(offsets))
+                for _ in range(self.prefetch)
+            )
+            while pages:
+                page = pages.popleft().result()
+                if page is None:
+                    for pending in pages:
+                        pending.cancel()
+                    return
+                pages.append(
+                    listing.submit(self.votings_list_page, next(offsets))
+                )
+                yield from page
 
-                    if match is None:
-                        raise Exception(text, offset)
+    def crawl(self, votings_folder: Path, delegates_folder: Path, manifest: DownloadManifest):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tasks = [executor.submit(
+                download_delegates_reference_data,
+                f"{self.domain}{DelegatesReferenceDataPath}",
+                delegates_folder, manifest, self.session
+            )]
+            filenames = set()
+            for voting in self.votings():
+                # a file listed twice would be downloaded twice at once
+                # into the same partial file
+                if voting.filename in filenames:
+                    count("duplicate listings")
+                    continue
+                filenames.add(voting.filename)
+                tasks.append(executor.submit(
+                    voting.download, votings_folder, manifest, self.session
+                ))
+            for task in tasks:
+                task.result()
+        remove_unlisted(votings_folder, filenames, manifest)
 
-                    voting_date = date(
-                        int(match.group(3)), int(
-                            match.group(2)), int(match.group(1))
-                    )
-                    title = match.group(4)
 
-                    yield VotingResultsFile(f"{Domain}{href}", voting_date, title)
-                    break
+def remove_unlisted(folder: Path, filenames: set, manifest: DownloadManifest):
+    # files renamed or withdrawn upstream are removed as a clean crawl would,
+    # the parser then drops the votings of files that are gone
+    for path in sorted(folder.iterdir()):
+        name = path.name[:-len(".part")] if path.name.endswith(".part") else path.name
+        if name in filenames:
+            continue
+        print(f"unlisted: {path}")
+        count("files unlisted")
+        manifest.forget(path)
+        path.unlink()
 
 
-def download_delegates_reference_data(url: str, destination: Path):
-    download(url, destination / DelegatesReferenceDataFilename)
-    with zipfile.ZipFile(destination / DelegatesReferenceDataFilename, mode="r") as zip:
-        open(destination / "schema.dtd",
-             mode="wb").write(zip.read("MDB_STAMMDATEN.DTD"))
-        open(destination / "data.xml",
-             mode="wb").write(zip.read("MDB_STAMMDATEN.XML"))
+def download_delegates_reference_data(url: str, destination: Path, manifest: DownloadManifest, session=requests):
+    # the parser reads the xml straight from the zip,
+    # copies extracted by previous versions are removed
+    for extracted in ["schema.dtd", "data.xml"]:
+        if (destination / extracted).exists():
+            (destination / extracted).unlink()
+    return download(
+        url, destination / DelegatesReferenceDataFilename, manifest,
+        revalidate=True, session=session
+    )
 
 
 def cleanup():
     if DataFolder.exists():
         shutil.rmtree(str(DataFolder))
+
+
+def prepare():
     DataFolder.mkdir(exist_ok=True)
     VotingsFolder.mkdir(exist_ok=True)
     DelegatesFolder.mkdir(exist_ok=True)
 
 
 if __name__ == "__main__":
-    cleanup()
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        download_delegates_reference_data_task = executor.submit(
-            download_delegates_reference_data, DelegatesReferenceDataUrl,
-            DelegatesFolder
-        )
-        executor.map(lambda v: v.download(VotingsFolder), votings())
-        download_delegates_reference_data_task.result()
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--clean", action="store_true")
+    arguments.add_argument("--domain", default=Domain)
+    arguments.add_argument("--jobs", type=int, default=10)
+    arguments.add_argument("--prefetch", type=int, default=4)
+    instrumentation.add_arguments(arguments)
+    args = arguments.parse_args()
+    instrumentation.start("crawler", profile=args.profile)
+
+    if args.clean:
+        cleanup()
+    prepare()
+    with DownloadManifest(DownloadManifestPath) as manifest, stage("crawl"):
+        Crawler(args.domain, max_workers=args.jobs, prefetch=args.prefetch) \
+            .crawl(VotingsFolder, DelegatesFolder, manifest)
+    for stat, value in manifest.stats.items():
+        count(f"downloads {stat}", value)
+    instrumentation.report()
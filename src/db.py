@@ -1,7 +1,11 @@
+import re
+import time
+import hashlib
 from pathlib import Path
 from enum import Enum
 from contextlib import contextmanager
-from peewee import SqliteDatabase, Model, ForeignKeyField, IntegerField, TextField, DateField, CompositeKey, fn
+from instrumentation import add_time, count
+from peewee import SqliteDatabase, Model, ForeignKeyField, FieldAccessor, IntegerField, TextField, DateField, BooleanField, FloatField, CompositeKey, Table, SQL, fn, chunked
 
 Db = Path("data/bundestag.sqlite")
 
@@ -16,10 +20,20 @@ db = SqliteDatabase(
 )
 
 
+SqliteMaxVariables = 999
+
+
 class DbModel(Model):
+    # rows of an upserting BatchWriter replace rows with the same key
+    upsert = True
+
     class Meta:
         database = db
 
+    @classmethod
+    def prepare(cls, row: dict) -> dict:
+        return row
+
 
 class Delegate(DbModel):
     id = IntegerField(unique=True, primary_key=True)
@@ -54,9 +68,9 @@ class DelegateName(DbModel):
     used_until = DateField(null=True)
 
     @classmethod
-    def create(cls, **kwargs):
+    def prepare(cls, row: dict) -> dict:
         full_name = " ".join(
-            kwargs.get(part)
+            row.get(part)
             for part in [
                 "title",
                 "first_name",
@@ -65,9 +79,13 @@ class DelegateName(DbModel):
                 "last_name",
                 "site",
             ]
-            if kwargs.get(part)
+            if row.get(part)
         )
-        return super().create(full_name=full_name, **kwargs)
+        return dict(row, full_name=full_name)
+
+    @classmethod
+    def create(cls, **kwargs):
+        return super().create(**cls.prepare(kwargs))
 
     def __str__(self):
         return self.full_name
@@ -93,22 +111,388 @@ class Voting(DbModel):
     title = TextField()
 
 
+# ids by name and names by id of the lookup tables, loaded once per connection
+Lookups = {}
+
+
+class Lookup(DbModel):
+    # the distinct values of a column, referenced by a LookupField
+    name = TextField(unique=True)
+
+    @classmethod
+    def load(cls, reload=False):
+        if reload or cls not in Lookups:
+            ids = dict(cls.select(cls.name, cls.id).tuples())
+            Lookups[cls] = ids, {id: name for name, id in ids.items()}
+        return Lookups[cls]
+
+    @classmethod
+    def id_of(cls, name: str, create=False) -> int:
+        # unknown names have no id, unless created when a row is written
+        ids, _ = cls.load()
+        if name not in ids and create:
+            cls.insert(name=name).on_conflict_ignore().execute()
+            ids, _ = cls.load(reload=True)
+        return ids.get(name)
+
+    @classmethod
+    def name_of(cls, id: int) -> str:
+        _, names = cls.load()
+        if id not in names:
+            _, names = cls.load(reload=True)
+        return names[id]
+
+
+class LookupField(ForeignKeyField):
+    # a foreign key to a lookup table row, but written and read as its name
+    accessor_class = FieldAccessor
+
+    def __init__(self, lookup, **kwargs):
+        super().__init__(lookup, backref="+", index=False, **kwargs)
+
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        return self.rel_model.id_of(value)
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return self.rel_model.name_of(value)
+
+
+class BallotGroup(Lookup):
+    pass
+
+
+class BallotResult(Lookup):
+    pass
+
+
 class Ballot(DbModel):
-    voting = ForeignKeyField(Voting, backref="ballots")
-    delegate = ForeignKeyField(Delegate, backref="ballots")
+    # clustered by voting, the other indexes are created after loading
+    voting = ForeignKeyField(Voting, backref="ballots", index=False)
+    delegate = ForeignKeyField(Delegate, backref="ballots", index=False)
+    group = LookupField(BallotGroup)
+    result = LookupField(BallotResult)
+    # the ballots of a voting are deleted before it is parsed again,
+    # the parser skips a second ballot of a delegate, so there are no updates
+    upsert = False
+
+    class Meta:
+        primary_key = CompositeKey("voting", "delegate")
+        without_rowid = True
+
+    @classmethod
+    def prepare(cls, row: dict) -> dict:
+        return dict(
+            row,
+            group=BallotGroup.id_of(row["group"], create=True),
+            result=BallotResult.id_of(row["result"], create=True),
+        )
+
+
+class IngestedFile(DbModel):
+    name = TextField(unique=True)
+    size = IntegerField()
+    sha256 = TextField()
+    voting = ForeignKeyField(Voting, null=True, backref="files")
+
+
+class TermGroupResult(DbModel):
+    term = IntegerField(index=True)
     group = TextField()
     result = TextField()
+    count = IntegerField()
+
+
+class TermPartyGender(DbModel):
+    term = IntegerField(index=True)
+    party = TextField(null=True)
+    gender = TextField()
+    serving = BooleanField()
+    count = IntegerField()
 
 
-Tables = [Delegate, DelegateName, DelegateTerm, Voting, Ballot]
+class TermPartyTitle(DbModel):
+    term = IntegerField(index=True)
+    party = TextField(null=True)
+    title = TextField(null=True)
+    serving = BooleanField()
+    count = IntegerField()
+
+
+class VotingTally(DbModel):
+    voting = ForeignKeyField(Voting, backref="tallies")
+    group = TextField()
+    result = TextField()
+    count = IntegerField()
+
+
+class DelegateSimilarity(DbModel):
+    # covered by the indexes created after loading
+    term = IntegerField()
+    delegate = ForeignKeyField(Delegate, backref="similarities", index=False)
+    rank = IntegerField()
+    neighbour = ForeignKeyField(Delegate, backref="+", index=False)
+    similarity = FloatField()
+    votings = IntegerField()
+
+
+SourceTables = [
+    Delegate, DelegateName, DelegateTerm, Voting,
+    BallotGroup, BallotResult, Ballot, IngestedFile,
+]
+Tables = SourceTables + [
+    TermGroupResult, TermPartyGender, TermPartyTitle, VotingTally,
+    DelegateSimilarity,
+]
+
+Indexes = [
+    Ballot.index(Ballot.voting, Ballot.group, Ballot.result),
+    Ballot.index(Ballot.delegate, Ballot.voting),
+    Voting.index(Voting.term, Voting.date),
+    DelegateTerm.index(DelegateTerm.term, DelegateTerm.delegate),
+    DelegateName.index(DelegateName.full_name),
+    DelegateSimilarity.index(
+        DelegateSimilarity.delegate, DelegateSimilarity.term, DelegateSimilarity.rank
+    ),
+]
+
+# full text search over voting titles and delegate biographies, diacritics
+# are removed so "Fluchtlinge" and "Flüchtlinge" match alike
+SearchColumns = {
+    Voting: ["title"],
+    Delegate: ["profession", "resume", "publications"],
+}
+SearchTokenizer = "unicode61 remove_diacritics 2"
+
+
+def search_table(model) -> str:
+    return f"{model._meta.table_name}_search"
+
+
+def create_search_tables():
+    # external content tables kept up to date by triggers, filled from
+    # the content table when created for an existing database
+    for model, columns in SearchColumns.items():
+        table, search = model._meta.table_name, search_table(model)
+        if db.table_exists(search):
+            continue
+        names = ", ".join(columns)
+        new = ", ".join(f"new.{column}" for column in columns)
+        old = ", ".join(f"old.{column}" for column in columns)
+        insert = f"INSERT INTO {search}(rowid, {names}) VALUES (new.id, {new});"
+        delete = f"INSERT INTO {search}({search}, rowid, {names}) VALUES ('delete', old.id, {old});"
+        with db.atomic():
+            db.execute_sql(
+                f"CREATE VIRTUAL TABLE {search} USING fts5({names}, "
+                f"content='{table}', content_rowid='id', tokenize='{SearchTokenizer}')"
+            )
+            db.execute_sql(f"CREATE TRIGGER IF NOT EXISTS {search}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+            db.execute_sql(f"CREATE TRIGGER IF NOT EXISTS {search}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+            db.execute_sql(f"CREATE TRIGGER IF NOT EXISTS {search}_update AFTER UPDATE ON {table} BEGIN {delete} {insert} END")
+            db.execute_sql(f"INSERT INTO {search}({search}) VALUES ('rebuild')")
+
+
+def drop_search_tables():
+    for model in SearchColumns:
+        db.execute_sql(f"DROP TABLE IF EXISTS {search_table(model)}")
+
+
+def search_match(query: str) -> str:
+    # every word of the query has to match as a prefix,
+    # so "Bundeswehreinsatz" also finds "Bundeswehreinsatzes"
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def search(model, query: str, limit=None) -> list:
+    # ids ranked by bm25
+    match = search_match(query)
+    if match is None:
+        return []
+    search = search_table(model)
+    sql = f"SELECT rowid FROM {search} WHERE {search} MATCH ? ORDER BY bm25({search})"
+    params = [match]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in model._meta.database.execute_sql(sql, params)]
+
+
+def ranked(select, model, query: str):
+    # restricts a select of the model to the rows matching the query,
+    # joined to the search table so the rows are ordered by bm25
+    match = search_match(query)
+    if match is None:
+        return select.where(SQL("0"))
+    name = search_table(model)
+    search = Table(name).alias(name)
+    return select \
+        .join(search, on=(search.c.rowid == model._meta.primary_key)) \
+        .where(SQL(f"{name} MATCH ?", [match])) \
+        .order_by(SQL(f"bm25({name})"), model._meta.primary_key)
+
+
+def search_votings(query: str, limit=None) -> list:
+    return search(Voting, query, limit)
+
+
+def search_delegates(query: str, limit=None) -> list:
+    return search(Delegate, query, limit)
+
+
+def create_indexes(changed=True):
+    # created after bulk loading, so inserts don't have to maintain them,
+    # statistics and search tables are only refreshed if rows were written
+    start = time.perf_counter()
+    with db.atomic():
+        for index in Indexes:
+            db.execute(index)
+        for model in SearchColumns if changed else []:
+            search = search_table(model)
+            db.execute_sql(f"INSERT INTO {search}({search}) VALUES ('optimize')")
+    if changed:
+        db.execute_sql("ANALYZE")
+    print(f"create indexes: {time.perf_counter() - start:.2f}s", flush=True)
+
+
+class BatchWriter:
+    def __init__(self, batch_size=10000, upsert=False):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.buffers = {}
+        self.rows = {}
+        self.seconds = {}
+        self.holding = False
+
+    def add(self, model, **row):
+        self.buffers.setdefault(model, []).append(model.prepare(row))
+        if not self.holding and len(self.buffers[model]) >= self.batch_size:
+            self.flush()
+
+    @contextmanager
+    def unit(self):
+        # rows added within a unit are never flushed partially,
+        # if the unit fails they are dropped from the buffers
+        marks = {model: len(rows) for model, rows in self.buffers.items()}
+        self.holding = True
+        try:
+            yield
+        except BaseException:
+            for model, rows in self.buffers.items():
+                del rows[marks.get(model, 0):]
+            raise
+        finally:
+            self.holding = False
+        if any(len(rows) >= self.batch_size for rows in self.buffers.values()):
+            self.flush()
+
+    def flush(self):
+        # flush every buffer in table order, so foreign keys are satisfied
+        with db.atomic():
+            for model in sorted(self.buffers, key=Tables.index):
+                rows = self.buffers[model]
+                if not rows:
+                    continue
+                start = time.perf_counter()
+                batch_size = max(SqliteMaxVariables // len(rows[0]), 1)
+                for batch in chunked(rows, batch_size):
+                    query = model.insert_many(batch)
+                    if self.upsert and model.upsert:
+                        keys = model._meta.get_primary_keys()
+                        query = query.on_conflict(
+                            conflict_target=list(keys),
+                            preserve=[
+                                model._meta.fields[name] for name in rows[0]
+                                if not any(model._meta.fields[name] is key for key in keys)
+                            ],
+                        )
+                    query.execute()
+                seconds = time.perf_counter() - start
+                self.seconds[model] = self.seconds.get(model, 0) + seconds
+                self.rows[model] = self.rows.get(model, 0) + len(rows)
+                add_time(f"insert {model._meta.table_name}", seconds)
+                count(f"rows inserted {model._meta.table_name}", len(rows))
+                rows.clear()
+
+    def report(self):
+        for model in sorted(self.rows, key=Tables.index):
+            rows, seconds = self.rows[model], self.seconds[model]
+            print(
+                f"insert {model._meta.table_name}: {rows} rows in {seconds:.2f}s"
+                f" ({rows / max(seconds, 1e-9):.0f} rows/s)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            self.report()
+
+
+def fingerprint() -> str:
+    # identifies the data by the ingested files and the resulting row counts,
+    # derived tables follow from these. ballots are only written together
+    # with the ingested file of their voting, so they are not counted,
+    # which would scan the largest table whenever the data changes
+    sha256 = hashlib.sha256()
+    ingested = IngestedFile \
+        .select(IngestedFile.name, IngestedFile.sha256) \
+        .order_by(IngestedFile.name) \
+        .tuples()
+    for name, file_hash in ingested:
+        sha256.update(f"{name}:{file_hash}\n".encode())
+    for model in SourceTables:
+        if model is Ballot:
+            continue
+        sha256.update(f"{model._meta.table_name}:{model.select().count()}\n".encode())
+    return sha256.hexdigest()
+
+
+def migrate_ballots():
+    # earlier databases stored group and result of a ballot as text
+    if "group" not in [column.name for column in db.get_columns("ballot")]:
+        return
+    start = time.perf_counter()
+    with db.atomic():
+        db.execute_sql("ALTER TABLE ballot RENAME TO ballot_text")
+        db.create_tables([BallotGroup, BallotResult, Ballot])
+        duplicates = db.execute_sql(
+            "SELECT voting_id, delegate_id, COUNT(*) FROM ballot_text "
+            "GROUP BY voting_id, delegate_id HAVING COUNT(*) > 1"
+        ).fetchall()
+        for voting_id, delegate_id, ballots in duplicates:
+            print(f"duplicate ballots: {ballots} of delegate {delegate_id} in voting {voting_id}, the last one is kept")
+        for model, column in [(BallotGroup, "group"), (BallotResult, "result")]:
+            db.execute_sql(
+                f'INSERT OR IGNORE INTO {model._meta.table_name} (name) '
+                f'SELECT "{column}" FROM ballot_text GROUP BY "{column}" ORDER BY MIN(id)'
+            )
+        db.execute_sql(
+            "INSERT OR REPLACE INTO ballot (voting_id, delegate_id, group_id, result_id) "
+            "SELECT b.voting_id, b.delegate_id, g.id, r.id FROM ballot_text b "
+            'JOIN ballotgroup g ON g.name = b."group" '
+            "JOIN ballotresult r ON r.name = b.result ORDER BY b.id"
+        )
+        db.execute_sql("DROP TABLE ballot_text")
+    print(f"migrate ballots: {time.perf_counter() - start:.2f}s", flush=True)
 
 
 @contextmanager
-def database(create=False):
+def database(create=False, rebuild=False):
     db.connect()
-    if create:
+    Lookups.clear()
+    if rebuild:
+        drop_search_tables()
         db.drop_tables(Tables)
+    if create or rebuild:
+        migrate_ballots()
         db.create_tables(Tables)
+        create_search_tables()
 
     try:
         yield db
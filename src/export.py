@@ -0,0 +1,314 @@
+import csv
+import json
+import time
+import shutil
+import argparse
+from bisect import bisect_right
+from datetime import date
+from pathlib import Path
+from typing import NamedTuple, Callable, List
+import instrumentation
+from instrumentation import stage, add_time, count
+from peewee import IntegerField, FloatField, DateField
+from db import database, db, Delegate, DelegateName, DelegateTerm, Voting, Ballot, BallotGroup, BallotResult
+
+ExportFolder = Path("data/export")
+Formats = ["csv", "jsonl", "parquet"]
+ChunkSize = 50000
+
+
+def pyarrow_modules():
+    # parquet is optional, pyarrow is only imported when it is written
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+class Export(NamedTuple):
+    name: str
+    columns: List[str]
+    fields: list
+    # chunks of rows, read from a cursor so only one chunk is held at a time
+    chunks: Callable
+    partition: str = None
+
+
+def iso_date(value):
+    # delegate dates are stored as in the reference data, e.g. 01.02.1960
+    if value is None or "." not in str(value):
+        return value
+    day, month, year = str(value).split(".")
+    return f"{year}-{month}-{day}"
+
+
+def cursor_chunks(query, chunk_size=ChunkSize):
+    cursor = db.execute(query)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def table_export(model, partition=None) -> Export:
+    fields = model._meta.sorted_fields
+    query = model.select(*fields).order_by(model._meta.primary_key).tuples()
+    return Export(
+        model._meta.table_name,
+        [field.column_name for field in fields],
+        fields,
+        lambda: cursor_chunks(query),
+        partition,
+    )
+
+
+class DelegateNames:
+    # the name a delegate used at a date, names are few enough to keep in memory.
+    # they are sorted after the conversion, the stored dates don't sort as text
+    def __init__(self):
+        self.names = {}
+        rows = DelegateName \
+            .select(DelegateName.delegate, DelegateName.used_from, DelegateName.full_name) \
+            .order_by(DelegateName.id) \
+            .tuples()
+        used = {}
+        for delegate_id, used_from, full_name in rows:
+            used.setdefault(delegate_id, []).append((iso_date(used_from) or "", full_name))
+        for delegate_id, names in used.items():
+            names.sort(key=lambda name: name[0])
+            self.names[delegate_id] = (
+                [used_from for used_from, _ in names], [full_name for _, full_name in names]
+            )
+
+    def at(self, delegate_id: int, day: str) -> str:
+        dates, names = self.names.get(delegate_id, ([], []))
+        if not names:
+            return None
+        return names[max(bisect_right(dates, day) - 1, 0)]
+
+
+def ballot_chunks(chunk_size=ChunkSize):
+    names = DelegateNames()
+    # the cursor returns the ids of group and result
+    _, groups = BallotGroup.load()
+    _, results = BallotResult.load()
+    query = Ballot \
+        .select(
+            Voting.term, Ballot.voting, Voting.date, Voting.title,
+            Ballot.delegate, Delegate.party, Ballot.group, Ballot.result,
+        ) \
+        .join(Voting).switch(Ballot).join(Delegate) \
+        .order_by(Ballot.voting) \
+        .tuples()
+    for rows in cursor_chunks(query, chunk_size):
+        yield [
+            (term, voting_id, day, title, delegate_id,
+             names.at(delegate_id, day), party, groups[group], results[result])
+            for term, voting_id, day, title, delegate_id, party, group, result in rows
+        ]
+
+
+def ballot_export() -> Export:
+    # one row per ballot with the voting and the delegate it belongs to
+    return Export(
+        "ballots",
+        ["term", "voting", "date", "title", "delegate", "name", "party", "group", "result"],
+        [
+            Voting.term, Ballot.voting, Voting.date, Voting.title,
+            Ballot.delegate, DelegateName.full_name, Delegate.party, BallotGroup.name, BallotResult.name,
+        ],
+        ballot_chunks,
+        "term",
+    )
+
+
+def exports() -> List[Export]:
+    return [
+        table_export(Delegate),
+        table_export(DelegateName),
+        table_export(DelegateTerm, partition="term"),
+        table_export(Voting, partition="term"),
+        ballot_export(),
+    ]
+
+
+class CsvWriter:
+    def __init__(self, folder: Path, export: Export):
+        self.path = folder / f"{export.name}.csv"
+        self.file = open(str(self.path), mode="w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(export.columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self) -> int:
+        self.file.close()
+        return self.path.stat().st_size
+
+
+class JsonlWriter:
+    def __init__(self, folder: Path, export: Export):
+        self.path = folder / f"{export.name}.jsonl"
+        self.file = open(str(self.path), mode="w", encoding="utf-8")
+        self.columns = export.columns
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, rows):
+        self.file.writelines(
+            self.encode(dict(zip(self.columns, row))) + "\n"
+            for row in rows
+        )
+
+    def close(self) -> int:
+        self.file.close()
+        return self.path.stat().st_size
+
+
+def arrow_type(pyarrow, field):
+    # foreign keys have the type of the field they refer to
+    field = getattr(field, "rel_field", None) or field
+    if isinstance(field, IntegerField):
+        return pyarrow.int64()
+    if isinstance(field, FloatField):
+        return pyarrow.float64()
+    if isinstance(field, DateField):
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+class ParquetWriter:
+    # tables with a partition column are written hive style, one file
+    # per value, e.g. ballots/term=19/part-0.parquet, without the column
+    def __init__(self, folder: Path, export: Export):
+        self.pyarrow, self.parquet = pyarrow_modules()
+        self.folder = folder
+        self.export = export
+        self.partition = None
+        if export.partition is not None:
+            self.partition = export.columns.index(export.partition)
+        self.schema = self.pyarrow.schema([
+            (column, arrow_type(self.pyarrow, field))
+            for index, (column, field) in enumerate(zip(export.columns, export.fields))
+            if index != self.partition
+        ])
+        self.dates = [
+            index for index, field in enumerate(self.schema.types)
+            if field == self.pyarrow.date32()
+        ]
+        self.writers = {}
+
+    def path(self, value) -> Path:
+        if self.export.partition is None:
+            return self.folder / f"{self.export.name}.parquet"
+        return self.folder / self.export.name / f"{self.export.partition}={value}" / "part-0.parquet"
+
+    def write(self, rows):
+        partitions = {}
+        if self.partition is None:
+            partitions[None] = rows
+        else:
+            for row in rows:
+                partitions.setdefault(row[self.partition], []).append(
+                    row[:self.partition] + row[self.partition + 1:]
+                )
+
+        for value, partition_rows in partitions.items():
+            columns = [list(column) for column in zip(*partition_rows)]
+            for index in self.dates:
+                columns[index] = [
+                    None if day is None else date.fromisoformat(day)
+                    for day in columns[index]
+                ]
+            if value not in self.writers:
+                path = self.path(value)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self.writers[value] = (path, self.parquet.ParquetWriter(str(path), self.schema))
+            self.writers[value][1].write_table(
+                self.pyarrow.Table.from_arrays(
+                    [self.pyarrow.array(column, type=type) for column, type in zip(columns, self.schema.types)],
+                    schema=self.schema
+                )
+            )
+
+    def close(self) -> int:
+        for _, writer in self.writers.values():
+            writer.close()
+        return sum(path.stat().st_size for path, _ in self.writers.values())
+
+
+Writers = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def export_table(export: Export, folder: Path, formats: List[str]):
+    # a single pass over the rows feeds every format
+    writers = {}
+    for export_format in formats:
+        (folder / export_format).mkdir(parents=True, exist_ok=True)
+        writers[export_format] = Writers[export_format](folder / export_format, export)
+
+    dates = [
+        index for index, field in enumerate(export.fields)
+        if isinstance(field, DateField)
+    ]
+    start = time.perf_counter()
+    rows = 0
+    writing = {export_format: 0.0 for export_format in writers}
+    for chunk in export.chunks():
+        for index in dates:
+            chunk = [
+                row[:index] + (iso_date(row[index]),) + row[index + 1:]
+                for row in chunk
+            ]
+        rows += len(chunk)
+        for export_format, writer in writers.items():
+            writing_start = time.perf_counter()
+            writer.write(chunk)
+            writing[export_format] += time.perf_counter() - writing_start
+    written = {}
+    for export_format, writer in writers.items():
+        writing_start = time.perf_counter()
+        written[export_format] = writer.close()
+        writing[export_format] += time.perf_counter() - writing_start
+    seconds = time.perf_counter() - start
+
+    add_time(f"export {export.name}", seconds)
+    count(f"rows exported {export.name}", rows)
+    for export_format, size in written.items():
+        add_time(f"export {export.name} {export_format}", writing[export_format])
+        count(f"bytes exported {export.name} {export_format}", size)
+    print(
+        f"export {export.name}: {rows} rows in {seconds:.2f}s"
+        f" ({rows / max(seconds, 1e-9):.0f} rows/s), "
+        + ", ".join(
+            f"{export_format} {size / 1e6:.1f} MB in {writing[export_format]:.2f}s"
+            for export_format, size in written.items()
+        ),
+        flush=True
+    )
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--format", action="append", choices=Formats)
+    arguments.add_argument("--output", type=Path, default=ExportFolder)
+    instrumentation.add_arguments(arguments)
+    args = arguments.parse_args()
+    instrumentation.start("export", profile=args.profile)
+
+    formats = args.format or Formats
+    if "parquet" in formats and pyarrow_modules() is None:
+        if args.format:
+            raise Exception("writing parquet requires pyarrow")
+        print("pyarrow is not installed, skipping parquet")
+        formats = [export_format for export_format in formats if export_format != "parquet"]
+
+    shutil.rmtree(str(args.output), ignore_errors=True)
+    with database():
+        for export in exports():
+            with stage(export.name):
+                export_table(export, args.output, formats)
+    instrumentation.report()
@@ -18,6 +18,13 @@
 # along with pygal. If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import gzip
+import json
+import uuid
+import base64
+import hashlib
+from pathlib import Path
 from traceback import format_exc, print_exc
 
 import docutils.core
@@ -26,6 +33,11 @@ from docutils.parsers.rst import Directive
 import pygal
 from sphinx.directives.code import CodeBlock
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Patch default style
 
 pygal.config.Config.style.value = pygal.style.RotateStyle(
@@ -39,6 +51,70 @@ pygal.config.Config.style.value = pygal.style.RotateStyle(
     opacity_hover='.9',
     transition='400ms ease-in')
 
+ChartSize = (600, 400)
+ChartsFolder = '_charts'
+
+
+def chart_key(code, width, height):
+    return hashlib.sha256(
+        ('%dx%d\n%s' % (width, height, code)).encode()).hexdigest()
+
+
+def find_chart(scope):
+    for key, value in scope.items():
+        if isinstance(value, pygal.graph.graph.Graph):
+            return key, value
+    return None, None
+
+
+def render_svg(chart, width, height, key=None):
+    # pygal names the chart with a random uuid, a key of the chart
+    # replaces it, so the same chart always renders the same svg
+    if key is not None:
+        chart.uuid = str(uuid.UUID(key[:32]))
+    chart.config.width = width
+    chart.config.height = height
+    chart.explicit_size = True
+    return chart.render(is_unicode=True)
+
+
+def execute(code):
+    """Execute the given code and return the chart as the directive finds it."""
+    scope = {'pygal': pygal}
+    exec(code, scope)
+    return find_chart(scope)
+
+
+def data_uri(svg):
+    return 'data:image/svg+xml;charset=utf-8;base64,%s' % (
+        base64.b64encode(svg.encode('utf-8')).decode('utf-8'))
+
+
+def compressors(names):
+    if 'gzip' in names:
+        yield '.gz', lambda data: gzip.compress(data, 9, mtime=0)
+    if 'brotli' in names and brotli is not None:
+        yield '.br', brotli.compress
+
+
+def write_file(path, data):
+    partial = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+    partial.write_bytes(data)
+    os.replace(str(partial), str(path))
+
+
+def write_chart(folder, svg, compression=()):
+    """Write the svg named by its content hash, identical charts share a file."""
+    data = svg.encode('utf-8')
+    name = hashlib.sha256(data).hexdigest() + '.svg'
+    path = Path(folder, name)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for suffix, compress in compressors(compression):
+            write_file(path.with_name(name + suffix), compress(data))
+        write_file(path, data)
+    return name
+
 
 class PygalDirective(Directive):
     """Execute the given python file and puts its result in the document."""
@@ -47,9 +123,19 @@ class PygalDirective(Directive):
     final_argument_whitespace = True
     has_content = True
 
+    def embed(self, svg):
+        env = self.state.document.settings.env
+        if not env.config.pygal_chart_files:
+            return '<embed src="%s" />' % data_uri(svg)
+        name = write_chart(
+            Path(env.app.outdir, ChartsFolder), svg,
+            env.config.pygal_chart_compression)
+        return '<embed src="%s%s/%s" />' % (
+            '../' * env.docname.count('/'), ChartsFolder, name)
+
     def run(self):
         width, height = map(int, self.arguments[:2]) if len(
-            self.arguments) >= 2 else (600, 400)
+            self.arguments) >= 2 else ChartSize
         if len(self.arguments) == 1:
             self.render_fix = bool(self.arguments[0])
         elif len(self.arguments) == 3:
@@ -61,6 +147,15 @@ class PygalDirective(Directive):
         if self.render_fix:
             content[-1] = 'rv = ' + content[-1]
         code = '\n'.join(content)
+        key = chart_key(code, width, height)
+        prerendered = Path(
+            self.state.document.settings.env.srcdir, ChartsFolder,
+            key + '.svg.json')
+        if not self.render_fix and prerendered.exists():
+            name, svg = json.loads(prerendered.read_text())
+            self.content.append(name + '.render()')
+            return [docutils.nodes.raw('', self.embed(svg), format='html')]
+
         scope = {'pygal': pygal}
         try:
             exec(code, scope)
@@ -74,22 +169,15 @@ class PygalDirective(Directive):
         if self.render_fix:
             rv = scope['rv']
         else:
-            chart = None
-            for key, value in scope.items():
-                if isinstance(value, pygal.graph.graph.Graph):
-                    chart = value
-                    self.content.append(key + '.render()')
-                    break
+            name, chart = find_chart(scope)
             if chart is None:
                 return [docutils.nodes.system_message(
                     'No instance of graph found', level=3,
                     type='ERROR', source='/')]
-            chart.config.width = width
-            chart.config.height = height
-            chart.explicit_size = True
+            self.content.append(name + '.render()')
 
         try:
-            svg = '<embed src="%s" />' % chart.render_data_uri()
+            svg = self.embed(render_svg(chart, width, height, key))
         except Exception:
             return [docutils.nodes.system_message(
                 'An exception as occured during graph generation:'
@@ -161,10 +249,23 @@ class PygalTableWithCode(PygalTable):
         return [docutils.nodes.compound('', *node_list)]
 
 
+def check_compression(app):
+    if 'brotli' in app.config.pygal_chart_compression and brotli is None:
+        print('brotli is not installed, skipping .br charts')
+
+
 def setup(app):
+    # the directive decides the output when a document is read
+    app.add_config_value('pygal_chart_files', False, 'env')
+    app.add_config_value('pygal_chart_compression', [], 'env')
+    app.connect('builder-inited', check_compression)
     app.add_directive('pygal', PygalDirective)
     app.add_directive('pygal-code', PygalWithCode)
     app.add_directive('pygal-table', PygalTable)
     app.add_directive('pygal-table-code', PygalTableWithCode)
 
-    return {'version': '1.0.1'}
+    return {
+        'version': '1.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -1,58 +1,218 @@
+import sys
+import re
+import json
 import shutil
+import hashlib
+import argparse
 from pathlib import Path
-import importlib.util
-from functools import partial
+from functools import partial, lru_cache
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from sphinx.cmd import build as sphinx_build
 from jinja2 import Template
-from textwrap import dedent
+from textwrap import dedent, indent
+from db import db
+from loader import load_module, import_file
+from cache import cache, CacheFolder
+from ext.pygal_sphinx_directives import ChartSize, ChartsFolder, chart_key, execute, render_svg, data_uri
+import instrumentation
+from instrumentation import stage, timer, count
 
 
 analyses = Path(__file__).parent / "analyses"
+charts = {}
 
 
-def import_file(filepath):
-    spec = importlib.util.spec_from_file_location(
-        Path(filepath).stem, str(filepath)
-    )
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+@lru_cache(maxsize=None)
+def source_hash(filepath: Path) -> str:
+    return hashlib.sha256(filepath.read_bytes()).hexdigest()
 
 
 def plot(filepath, fn, *args, **kwargs):
+    # the versions are part of the code, so the rst changes with them
     formatted_args = ", ".join(repr(arg) for arg in args)
-    return dedent(f"""
-    .. pygal::
-
+    code = dedent(f"""\
+        # analysis {source_hash(filepath)[:16]}, data {cache.data_version()[:16]}
         import generator
-        plot = generator.import_file("{filepath.absolute()}").__dict__["{fn}"]({formatted_args})
-    """)
+        plot = generator.import_file("{filepath.absolute()}").__dict__["{fn}"]({formatted_args})""")
+    charts[chart_key(code, *ChartSize)] = (f"{filepath.stem}.{fn}", code)
+    return "\n.. pygal::\n\n" + indent(code, "    ") + "\n"
+
+
+def prerender_chart(chart):
+    # failing charts are left to the directive, which reports the error
+    name, code = chart
+    try:
+        with timer(f"analysis {name}"):
+            key, graph = execute(code)
+        with timer(f"render {name}"):
+            rendered = None if graph is None else \
+                (key, render_svg(graph, *ChartSize, key=chart_key(code, *ChartSize)))
+    except Exception:
+        rendered = None
+    stats = Counter(cache.stats)
+    cache.stats.clear()
+    return rendered, stats, instrumentation.snapshot()
+
+
+def start_worker():
+    # forked workers start without the measurements of the parent
+    cache.stats.clear()
+    instrumentation.reset()
+
+
+def prerender_charts(folder: Path, jobs=1):
+    # charts rendered by a previous build are reused, unused ones removed
+    folder.mkdir(exist_ok=True)
+    for rendered in folder.glob("*.json"):
+        if rendered.name.split(".")[0] not in charts:
+            rendered.unlink()
+    pending = {
+        key: chart for key, chart in charts.items()
+        if not (folder / f"{key}.svg.json").exists()
+    }
+    # workers connect on their own
+    if not db.is_closed():
+        db.close()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=start_worker) as executor:
+            results = list(executor.map(prerender_chart, pending.values()))
+    else:
+        results = list(map(prerender_chart, pending.values()))
+    for key, (rendered, stats, measurements) in zip(pending, results):
+        cache.stats.update(stats)
+        instrumentation.merge(measurements)
+        if rendered is not None:
+            (folder / f"{key}.svg.json").write_text(json.dumps(rendered))
+    print(
+        f"charts: {len(pending)} rendered, {len(charts) - len(pending)} reused",
+        flush=True
+    )
+    count("charts rendered", len(pending))
+    count("charts reused", len(charts) - len(pending))
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    # unchanged sources keep their mtime, so sphinx doesn't read them again
+    if path.exists() and path.read_text() == text:
+        return False
+    path.write_text(text)
+    return True
+
+
+def remove_unused_charts(html: Path) -> list:
+    # charts no page refers to anymore are removed, also when the charts
+    # are inlined again after a build with chart files
+    folder = html / ChartsFolder
+    references = [
+        name
+        for page in html.rglob("*.html")
+        for name in re.findall(rf'{ChartsFolder}/([0-9a-f]{{64}}\.svg)"', page.read_text())
+    ]
+    for chart in folder.glob("*.svg*"):
+        if chart.name.split(".")[0] + ".svg" not in references:
+            chart.unlink()
+    return references
+
+
+def chart_files_report(html: Path, references: list):
+    # compares the sizes of the files with the data uris they replace
+    folder = html / ChartsFolder
+    inlined = sum(
+        len(data_uri((folder / name).read_text(encoding="utf-8")))
+        for name in references
+    )
+    sizes = {
+        suffix: sum(
+            (folder / f"{name}{suffix}").stat().st_size
+            for name in set(references)
+            if (folder / f"{name}{suffix}").exists()
+        )
+        for suffix in ["", ".gz", ".br"]
+    }
+    print(
+        f"chart bytes: {inlined} inlined before, {sizes['']} as files "
+        f"({len(set(references))} files for {len(references)} charts), "
+        f"{sizes['.gz']} gzip, {sizes['.br']} brotli",
+        flush=True
+    )
 
 
 def iter_analyses():
-    for analysis in analyses.iterdir():
+    for analysis in sorted(analyses.iterdir()):
         if analysis.suffix == ".py" and not analysis.name.startswith("_"):
             yield analysis
 
 
+def plotted_functions(module):
+    # the plot() calls of a template with their arguments, in order
+    calls = []
+    Template(module.template).render(
+        this=module, plot=lambda fn, *args: calls.append((fn, args)) or ""
+    )
+    return calls
+
+
 if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--disk-cache", action="store_true")
+    arguments.add_argument("--jobs", type=int, default=1)
+    arguments.add_argument("--incremental", action="store_true")
+    arguments.add_argument("--chart-files", action="store_true")
+    arguments.add_argument(
+        "--compress", action="append", choices=["gzip", "brotli"], default=[]
+    )
+    instrumentation.add_arguments(arguments)
+    args = arguments.parse_args()
+    instrumentation.start("generator", profile=args.profile)
+
+    if args.disk_cache:
+        cache.folder = CacheFolder
+    # the directives import generator, share the module cache with them
+    sys.modules["generator"] = sys.modules[__name__]
+
     for directory in ["rst", "html"]:
-        if Path(directory).exists():
+        if Path(directory).exists() and not args.incremental:
             shutil.rmtree(directory)
-        Path(directory).mkdir()
+        Path(directory).mkdir(exist_ok=True)
 
     index = []
-    for analysis in iter_analyses():
-        module = import_file(analysis)
+    written = 0
+    with stage("templates"):
+        for analysis in iter_analyses():
+            module = import_file(analysis)
 
-        template = Template(module.template)
-        rendered = template.render(this=module, plot=partial(plot, analysis))
+            template = Template(module.template)
+            rendered = template.render(this=module, plot=partial(plot, analysis))
 
-        Path("rst", f"{analysis.stem}.rst").write_text(rendered)
-        index.append(analysis.stem)
+            written += write_if_changed(Path("rst", f"{analysis.stem}.rst"), rendered)
+            index.append(analysis.stem)
 
-    Path("rst", "index.rst").write_text(
-        ".. toctree::\n"
-        + "\n".join(f"    {i}" for i in index)
-    )
-    sphinx_build.main(["-b", "html", "-c", "src", "rst", "html"])
+        written += write_if_changed(Path("rst", "index.rst"), (
+            ".. toctree::\n"
+            + "\n".join(f"    {i}" for i in index)
+        ))
+        for source in Path("rst").glob("*.rst"):
+            if source.stem not in index + ["index"]:
+                source.unlink()
+    print(f"rst: {written} written, {len(index) + 1 - written} unchanged")
+    count("rst written", written)
+    with stage("charts"):
+        prerender_charts(Path("rst", ChartsFolder), jobs=args.jobs)
+    options = []
+    if args.chart_files:
+        options += ["-D", "pygal_chart_files=1"]
+    if args.compress:
+        options += ["-D", f"pygal_chart_compression={','.join(args.compress)}"]
+    with stage("sphinx"):
+        sphinx_build.main(
+            ["-b", "html", "-c", "src", "-j", str(args.jobs), *options, "rst", "html"]
+        )
+    references = remove_unused_charts(Path("html"))
+    if args.chart_files:
+        chart_files_report(Path("html"), references)
+    cache.report()
+    print(f"import analyses: {load_module.cache_info()}")
+    for stat, value in cache.stats.items():
+        count(f"query cache {stat}", value)
+    instrumentation.report()
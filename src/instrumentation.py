@@ -0,0 +1,152 @@
+import csv
+import json
+import time
+import cProfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+ReportsFolder = Path("data/reports")
+
+
+class Instrumentation:
+    # timers and counters of a run, reported as json and appended to a csv history
+    def __init__(self):
+        self.script = None
+        self.started = None
+        self.profiled = set()
+        self.timers = {}
+        self.counters = {}
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def start(self, script: str, profile=()):
+        self.script = script
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.profiled = set(profile)
+
+    def count(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value):
+        with self.lock:
+            calls, total, low, high = self.samples.get(name, (0, 0, value, value))
+            self.samples[name] = (calls + 1, total + value, min(low, value), max(high, value))
+
+    def add_time(self, name: str, seconds: float, calls=1):
+        with self.lock:
+            previous_calls, previous_seconds = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (previous_calls + calls, previous_seconds + seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    @contextmanager
+    def stage(self, name: str):
+        # a timed stage, profiled when named in --profile
+        profiler = None
+        if name in self.profiled or "all" in self.profiled:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with self.timer(f"stage {name}"):
+                yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                ReportsFolder.mkdir(parents=True, exist_ok=True)
+                profile = ReportsFolder / f"{self.script}-{name}.prof"
+                profiler.dump_stats(str(profile))
+                print(f"profile of {name} written to {profile}", flush=True)
+
+    def reset(self):
+        with self.lock:
+            self.timers, self.counters, self.samples = {}, {}, {}
+
+    def snapshot(self) -> dict:
+        # hands the measurements of a worker process over to the parent
+        with self.lock:
+            measurements = dict(
+                timers=self.timers, counters=self.counters, samples=self.samples
+            )
+            self.timers, self.counters, self.samples = {}, {}, {}
+        return measurements
+
+    def merge(self, measurements: dict):
+        for name, (calls, seconds) in measurements["timers"].items():
+            self.add_time(name, seconds, calls)
+        for name, value in measurements["counters"].items():
+            self.count(name, value)
+        for name, (calls, total, low, high) in measurements["samples"].items():
+            with self.lock:
+                previous = self.samples.get(name, (0, 0, low, high))
+                self.samples[name] = (
+                    previous[0] + calls, previous[1] + total,
+                    min(previous[2], low), max(previous[3], high),
+                )
+
+    def rows(self):
+        for name, (calls, seconds) in sorted(self.timers.items()):
+            yield "timer", name, calls, round(seconds, 6)
+        for name, value in sorted(self.counters.items()):
+            yield "counter", name, 1, value
+        for name, (calls, total, low, high) in sorted(self.samples.items()):
+            yield "sample", name, calls, total
+            yield "sample min", name, calls, low
+            yield "sample max", name, calls, high
+
+    def report(self, folder: Path = ReportsFolder):
+        folder.mkdir(parents=True, exist_ok=True)
+        report = dict(
+            script=self.script,
+            started=self.started,
+            timers={
+                name: dict(calls=calls, seconds=round(seconds, 6))
+                for name, (calls, seconds) in sorted(self.timers.items())
+            },
+            counters=dict(sorted(self.counters.items())),
+            samples={
+                name: dict(calls=calls, total=total, min=low, max=high, mean=total / calls)
+                for name, (calls, total, low, high) in sorted(self.samples.items())
+            },
+        )
+        (folder / f"{self.script}.json").write_text(json.dumps(report, indent=2))
+
+        history = folder / f"{self.script}.csv"
+        new = not history.exists()
+        with open(str(history), mode="a", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            if new:
+                writer.writerow(["started", "kind", "name", "calls", "value"])
+            for row in self.rows():
+                writer.writerow([self.started, *row])
+
+        for name, (calls, seconds) in sorted(self.timers.items()):
+            if name.startswith("stage "):
+                print(f"{name}: {seconds:.2f}s", flush=True)
+        print(f"report written to {folder / self.script}.json", flush=True)
+
+
+instrumentation = Instrumentation()
+start = instrumentation.start
+stage = instrumentation.stage
+timer = instrumentation.timer
+count = instrumentation.count
+observe = instrumentation.observe
+add_time = instrumentation.add_time
+reset = instrumentation.reset
+snapshot = instrumentation.snapshot
+merge = instrumentation.merge
+report = instrumentation.report
+
+
+def add_arguments(arguments):
+    # cProfile dumps of the named stages, or all, are written to the reports
+    arguments.add_argument("--profile", action="append", default=[], metavar="STAGE")
@@ -0,0 +1,19 @@
+import importlib.util
+from pathlib import Path
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def load_module(filepath: str, mtime: int):
+    spec = importlib.util.spec_from_file_location(
+        Path(filepath).stem, filepath
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def import_file(filepath):
+    # every pygal directive imports its analysis, it is executed once per change
+    filepath = Path(filepath).absolute()
+    return load_module(str(filepath), filepath.stat().st_mtime_ns)
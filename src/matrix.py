@@ -0,0 +1,155 @@
+import os
+import json
+from pathlib import Path
+from typing import NamedTuple, List
+import numpy as np
+from db import db, BallotGroup, BallotResult
+from cache import cache
+
+MatrixFolder = Path("data/matrix")
+Results = ["ja", "nein", "Enthaltung", "ungültig", "nichtabgegeben"]
+Arrays = [
+    "results",
+    "groups",
+    "delegate_ids",
+    "delegate_parties",
+    "voting_ids",
+    "voting_terms",
+    "voting_dates",
+]
+
+
+class VoteMatrix(NamedTuple):
+    # delegates x votings, code 0 means the delegate has no ballot,
+    # otherwise results[d, v] - 1 indexes Results and groups[d, v] - 1 group_names
+    results: np.ndarray
+    groups: np.ndarray
+    delegate_ids: np.ndarray
+    delegate_parties: np.ndarray
+    voting_ids: np.ndarray
+    voting_terms: np.ndarray
+    voting_dates: np.ndarray
+    group_names: List[str]
+    party_names: List[str]
+    fingerprint: str
+
+    def result_code(self, result: str) -> int:
+        return Results.index(result) + 1
+
+    def group_code(self, group: str) -> int:
+        return self.group_names.index(group) + 1
+
+    def select(self, term=None, party=None, since=None, until=None):
+        columns = np.ones(len(self.voting_ids), dtype=bool)
+        if term is not None:
+            columns &= self.voting_terms == term
+        if since is not None:
+            columns &= self.voting_dates >= np.datetime64(since, "D")
+        if until is not None:
+            columns &= self.voting_dates <= np.datetime64(until, "D")
+
+        rows = np.ones(len(self.delegate_ids), dtype=bool)
+        if party is not None:
+            rows &= self.delegate_parties == self.party_names.index(party)
+        rows &= (self.results[:, columns] != 0).any(axis=1)
+
+        grid = np.ix_(rows, columns)
+        return self._replace(
+            results=self.results[grid],
+            groups=self.groups[grid],
+            delegate_ids=self.delegate_ids[rows],
+            delegate_parties=self.delegate_parties[rows],
+            voting_ids=self.voting_ids[columns],
+            voting_terms=self.voting_terms[columns],
+            voting_dates=self.voting_dates[columns],
+        )
+
+
+def export(folder: Path = MatrixFolder) -> VoteMatrix:
+    current = cache.data_version()
+    votings = db.execute_sql(
+        "SELECT id, term, date FROM voting ORDER BY id"
+    ).fetchall()
+    delegates = db.execute_sql(
+        "SELECT id, party FROM delegate"
+        " WHERE id IN (SELECT delegate_id FROM ballot) ORDER BY id"
+    ).fetchall()
+
+    voting_ids = np.array([id for id, _, _ in votings], dtype=np.int64)
+    delegate_ids = np.array([id for id, _ in delegates], dtype=np.int64)
+    party_names = sorted({party for _, party in delegates}, key=str)
+    arrays = dict(
+        results=np.zeros((len(delegates), len(votings)), dtype=np.int8),
+        groups=np.zeros((len(delegates), len(votings)), dtype=np.int8),
+        delegate_ids=delegate_ids,
+        delegate_parties=np.array(
+            [party_names.index(party) for _, party in delegates],
+            dtype=np.int16
+        ),
+        voting_ids=voting_ids,
+        voting_terms=np.array([term for _, term, _ in votings], dtype=np.int16),
+        voting_dates=np.array(
+            [str(date) for _, _, date in votings], dtype="datetime64[D]"
+        ),
+    )
+
+    rows = {id: row for row, id in enumerate(delegate_ids)}
+    columns = {id: column for column, id in enumerate(voting_ids)}
+    # ballots store ids of the lookup tables, groups are numbered in the
+    # order they were first seen
+    result_codes = {
+        id: Results.index(result) + 1 for result, id in BallotResult.load()[0].items()
+    }
+    _, group_names = BallotGroup.load()
+    group_codes = {id: code for code, id in enumerate(sorted(group_names), 1)}
+    cursor = db.execute_sql(
+        "SELECT delegate_id, voting_id, group_id, result_id FROM ballot"
+    )
+    while True:
+        ballots = cursor.fetchmany(10000)
+        if not ballots:
+            break
+        delegate_rows = [rows[delegate] for delegate, _, _, _ in ballots]
+        voting_columns = [columns[voting] for _, voting, _, _ in ballots]
+        arrays["results"][delegate_rows, voting_columns] = [
+            result_codes[result] for _, _, _, result in ballots
+        ]
+        arrays["groups"][delegate_rows, voting_columns] = [
+            group_codes[group] for _, _, group, _ in ballots
+        ]
+
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        # written under a temporary name, so a reader never sees partial files
+        with open(str(folder / f"{name}.npy.tmp"), mode="wb") as file:
+            np.save(file, array)
+        os.replace(str(folder / f"{name}.npy.tmp"), str(folder / f"{name}.npy"))
+    (folder / "meta.json.tmp").write_text(json.dumps(dict(
+        group_names=[group_names[id] for id in sorted(group_names)],
+        party_names=party_names,
+        fingerprint=current,
+    )))
+    os.replace(str(folder / "meta.json.tmp"), str(folder / "meta.json"))
+    print(
+        f"export matrix: {len(delegates)} delegates x {len(votings)} votings",
+        flush=True
+    )
+    return read(folder)
+
+
+def read(folder: Path = MatrixFolder) -> VoteMatrix:
+    meta = json.loads((folder / "meta.json").read_text())
+    return VoteMatrix(
+        **{
+            name: np.load(str(folder / f"{name}.npy"), mmap_mode="r")
+            for name in Arrays
+        },
+        **meta
+    )
+
+
+def load(folder: Path = MatrixFolder) -> VoteMatrix:
+    meta = folder / "meta.json"
+    if meta.exists() and json.loads(meta.read_text())["fingerprint"] == cache.data_version():
+        return read(folder)
+    return export(folder)
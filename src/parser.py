@@ -1,154 +1,362 @@
 import re
+import hashlib
+import zipfile
+import argparse
 import itertools
 from pathlib import Path
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor
 import xml.etree.ElementTree as ET
-import xlrd
-from db import database, Delegate, DelegateName, DelegateTerm, Voting, Ballot
+from sheets import read_rows
+from db import db, database, create_indexes, BatchWriter, Delegate, DelegateName, DelegateTerm, Voting, Ballot, VotingTally, IngestedFile, fn
+from resolver import DelegateResolver
+import rollup
+import matrix
+import similarity
+import instrumentation
+from instrumentation import stage, count, observe
 
 
-DelegatesPath = Path("data/delegates/data.xml")
+DelegatesPath = Path("data/delegates/delegates_reference_data.zip")
+DelegatesMember = "MDB_STAMMDATEN.XML"
 VotingsFolder = Path("data/votings")
+VotingFilePattern = re.compile(r"(\d\d\d\d-\d\d-\d\d)_(.+)\.xlsx?")
 
+DelegateFields = {
+    "PARTEI_KURZ": "party",
+    "GEBURTSDATUM": "birthday",
+    "GEBURTSORT": "birthplace",
+    "GEBURTSLAND": "native_country",
+    "STERBEDATUM": "deathday",
+    "GESCHLECHT": "gender",
+    "FAMILIENSTAND": "familiy_status",
+    "RELIGION": "religion",
+    "BERUF": "profession",
+    "VITA_KURZ": "resume",
+    "VEROEFFENTLICHUNGSPFLICHTIGES": "publications",
+}
+DelegateNameFields = {
+    "VORNAME": "first_name",
+    "NACHNAME": "last_name",
+    "PRAEFIX": "prefix",
+    "ADEL": "nobility",
+    "ORTSZUSATZ": "site",
+    "ANREDE_TITEL": "title",
+    "HISTORIE_VON": "used_from",
+    "HISTORIE_BIS": "used_until",
+}
+DelegateTermFields = {
+    "WP": "term",
+    "MDBWP_VON": "term_from",
+    "MDBWP_BIS": "term_until",
+    "WKR_NUMMER": "electoral_district_number",
+    "WKR_NAME": "electoral_district_name",
+    "WKR_LAND": "electoral_district_state",
+    "LISTE": "state_list",
+    "MANDATSART": "mandat_kind",
+}
 
-def parse_delegates():
-    delegates = ET.parse(DelegatesPath).getroot()
-    for delegate_node in delegates.findall("MDB"):
-        print(f"parse delegate: {delegate_node.find('ID').text}")
-        delegate = Delegate.create(
-            id=int(delegate_node.find("ID").text),
-            party=delegate_node.find("BIOGRAFISCHE_ANGABEN/PARTEI_KURZ").text,
-            birthday=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/GEBURTSDATUM").text,
-            birthplace=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/GEBURTSORT").text,
-            native_country=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/GEBURTSLAND").text,
-            deathday=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/STERBEDATUM").text,
-            gender=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/GESCHLECHT").text,
-            familiy_status=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/FAMILIENSTAND").text,
-            religion=delegate_node.find("BIOGRAFISCHE_ANGABEN/RELIGION").text,
-            profession=delegate_node.find("BIOGRAFISCHE_ANGABEN/BERUF").text,
-            resume=delegate_node.find("BIOGRAFISCHE_ANGABEN/VITA_KURZ").text,
-            publications=delegate_node.find(
-                "BIOGRAFISCHE_ANGABEN/VEROEFFENTLICHUNGSPFLICHTIGES").text,
-        )
-        for name_node in delegate_node.findall("NAMEN/NAME"):
-            DelegateName.create(
-                delegate=delegate,
-                first_name=name_node.find("VORNAME").text,
-                last_name=name_node.find("NACHNAME").text,
-                prefix=name_node.find("PRAEFIX").text,
-                nobility=name_node.find("ADEL").text,
-                site=name_node.find("ORTSZUSATZ").text,
-                title=name_node.find("ANREDE_TITEL").text,
-                used_from=name_node.find("HISTORIE_VON").text,
-                used_until=name_node.find("HISTORIE_BIS").text,
-            )
 
-        for term_node in delegate_node.findall("WAHLPERIODEN/WAHLPERIODE"):
-            DelegateTerm.create(
+def file_hash(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, mode="rb") as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ChangedFile(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+    ingested: IngestedFile
+
+
+def ingested_files() -> dict:
+    return {entry.name: entry for entry in IngestedFile.select()}
+
+
+def changed_file(path: Path, ingested: dict) -> ChangedFile:
+    # None if the file was ingested as it is
+    size = path.stat().st_size
+    sha256 = file_hash(path)
+    entry = ingested.get(str(path))
+    if entry is None or entry.size != size or entry.sha256 != sha256:
+        return ChangedFile(path, size, sha256, entry)
+    return None
+
+
+def changed_files(paths):
+    ingested = ingested_files()
+    for path in paths:
+        changed = changed_file(path, ingested)
+        if changed is not None:
+            yield changed
+
+
+def remove_vanished(keep=()) -> set:
+    # votings of files that are gone, renamed or withdrawn upstream, are
+    # removed with their ballots, unless the file is about to be downloaded
+    terms = set()
+    for entry in ingested_files().values():
+        path = Path(entry.name)
+        if path.exists() or path in keep:
+            continue
+        print(f"vanished: {path}")
+        count("files vanished")
+        with db.atomic():
+            entry.delete_instance()
+            voting = Voting.get_or_none(Voting.id == entry.voting_id)
+            if voting is not None:
+                terms.add(voting.term)
+                Ballot.delete().where(Ballot.voting == voting.id).execute()
+                VotingTally.delete().where(VotingTally.voting == voting.id).execute()
+                voting.delete_instance()
+    return terms
+
+
+def record_ingested(writer: BatchWriter, changed: ChangedFile, voting=None):
+    if changed.ingested is not None:
+        changed.ingested.delete_instance()
+    writer.add(
+        IngestedFile,
+        name=str(changed.path),
+        size=changed.size,
+        sha256=changed.sha256,
+        voting=voting,
+    )
+
+
+def parse_delegates(writer: BatchWriter):
+    changed = next(changed_files([DelegatesPath]), None)
+    if changed is None:
+        print(f"unchanged: {DelegatesPath}")
+        return False
+
+    with db.atomic():
+        # delegates are upserted, names and terms are replaced
+        DelegateName.delete().execute()
+        DelegateTerm.delete().execute()
+        add_delegates(writer)
+        record_ingested(writer, changed)
+        writer.flush()
+    return True
+
+
+def iter_delegate_nodes(path: Path):
+    with zipfile.ZipFile(path, mode="r") as archive, \
+            archive.open(DelegatesMember) as xml:
+        events = ET.iterparse(xml, events=("start", "end"))
+        _, root = next(events)
+        for event, node in events:
+            if event == "end" and node.tag == "MDB":
+                yield node
+                node.clear()
+                root.remove(node)
+
+
+def mapped_fields(node, fields: dict) -> dict:
+    row = dict.fromkeys(fields.values())
+    for child in node if node is not None else []:
+        field = fields.get(child.tag)
+        if field is not None:
+            row[field] = child.text
+    return row
+
+
+def add_delegates(writer: BatchWriter):
+    for delegate_node in iter_delegate_nodes(DelegatesPath):
+        print(f"parse delegate: {delegate_node.findtext('ID')}")
+        delegate = int(delegate_node.findtext("ID"))
+        count("delegates parsed")
+        writer.add(
+            Delegate,
+            id=delegate,
+            **mapped_fields(
+                delegate_node.find("BIOGRAFISCHE_ANGABEN"), DelegateFields
+            )
+        )
+        for name_node in delegate_node.iterfind("NAMEN/NAME"):
+            writer.add(
+                DelegateName,
                 delegate=delegate,
-                term=int(term_node.find("WP").text),
-                term_from=term_node.find("MDBWP_VON").text,
-                term_until=term_node.find("MDBWP_BIS").text,
-                electoral_district_number=term_node.find("WKR_NUMMER").text,
-                electoral_district_name=term_node.find("WKR_NAME").text,
-                electoral_district_state=term_node.find("WKR_LAND").text,
-                state_list=term_node.find("LISTE").text,
-                mandat_kind=term_node.find("MANDATSART").text,
+                **mapped_fields(name_node, DelegateNameFields)
             )
 
+        for term_node in delegate_node.iterfind("WAHLPERIODEN/WAHLPERIODE"):
+            term = mapped_fields(term_node, DelegateTermFields)
+            term["term"] = int(term["term"])
+            writer.add(DelegateTerm, delegate=delegate, **term)
 
-DelegateNameFixes = {
-    "  ": " ",
-    "h.c.": "h. c.",
-    "Dr. Bernd Fabritius": "Dr. Dr. h. c. Bernd Fabritius",
-    "Andre ": "André ",
-    "Aydan Özoguz": "Aydan Özoğuz",
-    "Sevim Dagdelen": "Sevim Dağdelen",
-    "Dr. h. c. Albert Weiler": "Dr. h. c. (NUACA) Albert H. Weiler",
-    "Elvan Korkmaz-Emre": "Elvan Korkmaz",
-    "Michael Link (Heilbronn)": "Michael Georg Link (Heilbronn)",
-    "Eva-Maria Elisabeth Schreiber": "Eva-Maria Schreiber",
-    "Joana Eleonora Cotar": "Joana Cotar",
-    "Albrecht Heinz Erhard Glaser": "Albrecht Glaser",
-    "Konstantin Elias Kuhle": "Konstantin Kuhle",
-    "Michaela Engelmeier-Heite": "Michaela Engelmeier",
-    "Siegfried Kauder (Villingen-Schwenningen)": "Siegfried Kauder (Villingen-Schw.)",
-    "Dr. Andreas Scheuer": "Andreas Scheuer",
-    "Agnes Brugger": "Agnieszka Brugger",
-    "Ronja Schmitt (Althengstett)": "Ronja Schmitt",
-}
 
+class VotingRecord(NamedTuple):
+    file: Path
+    voting: dict
+    ballots: list
 
-def parse_votings():
-    def fix_delegate_name(name):
-        for corrupt, correct in DelegateNameFixes.items():
-            if name != correct:
-                name = name.replace(corrupt, correct)
-        return name
 
-    def mapped(rows):
-        headers_mapping = {
-            "Bezeichnung": "full_name",
-            "Fraktion/Gruppe": "group"
+def mapped(rows):
+    headers_mapping = {
+        "Bezeichnung": "full_name",
+        "Fraktion/Gruppe": "group"
+    }
+    headers = next(rows)
+    for row in rows:
+        yield {
+            headers_mapping.get(header, header): value
+            for header, value in zip(headers, row)
         }
-        headers = [header.value for header in next(rows)]
-        for row in rows:
-            yield {
-                headers_mapping.get(header, header): cell.value
-                for header, cell in zip(headers, row)
-            }
-
-    def get_choice(row):
-        for choice in ["ja", "nein", "Enthaltung", "ungültig", "nichtabgegeben"]:
-            if row.get(choice) == 1:
-                return choice
-        raise Exception(f"invalid row: {row}")
 
+
+def get_choice(row):
+    for choice in ["ja", "nein", "Enthaltung", "ungültig", "nichtabgegeben"]:
+        if row.get(choice) == 1:
+            return choice
+    raise Exception(f"invalid row: {row}")
+
+
+def voting_files():
     for voting_file in sorted(VotingsFolder.iterdir()):
-        match = re.match(r"(\d\d\d\d-\d\d-\d\d)_(.+)\.xlsx?", voting_file.name)
-        if match:
-            print(f"parse: {voting_file}")
-            sheet = xlrd.open_workbook(voting_file).sheet_by_index(0)
-            voting = Voting.create(
-                term=int(sheet.cell_value(rowx=1, colx=0)),
-                session=int(sheet.cell_value(rowx=1, colx=1)),
-                voting=int(sheet.cell_value(rowx=1, colx=2)),
-                date=match.group(1),
-                title=match.group(2)
-            )
-            for row in mapped(sheet.get_rows()):
-                full_name = fix_delegate_name(row["full_name"])
-                distinct_delegate_ids = {
-                    delegate_name.delegate_id
-                    for delegate_name in DelegateName
-                    .select()
-                    .join(Delegate)
-                    .join(DelegateTerm)
-                    .where(
-                        (DelegateName.full_name % f"*{full_name}*")
-                        & (DelegateTerm.term == voting.term)
-                    )
-                }
-                if len(distinct_delegate_ids) == 0:
-                    print(f"delegate not found: '{full_name}'")
-                    continue
-                if len(distinct_delegate_ids) > 1:
-                    raise Exception(f"ambigous delegate name: {full_name}")
-
-                Ballot.create(
-                    voting=voting,
-                    delegate=Delegate.get_by_id(distinct_delegate_ids.pop()),
-                    result=get_choice(row),
-                    group=row["group"],
+        if VotingFilePattern.match(voting_file.name):
+            yield voting_file
+
+
+def read_voting(voting_file: Path) -> VotingRecord:
+    match = VotingFilePattern.match(voting_file.name)
+    rows = list(read_rows(voting_file))
+    voting = dict(
+        term=int(rows[1][0]),
+        session=int(rows[1][1]),
+        voting=int(rows[1][2]),
+        date=match.group(1),
+        title=match.group(2)
+    )
+    ballots = [
+        (row["full_name"], row["group"], get_choice(row))
+        for row in mapped(iter(rows))
+    ]
+    return VotingRecord(voting_file, voting, ballots)
+
+
+def read_votings(files, jobs=1):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(read_voting, files)
+    else:
+        yield from map(read_voting, files)
+
+
+class VotingsWriter:
+    # adds parsed voting files, new votings get their ids in the order they are added
+    def __init__(self, writer: BatchWriter):
+        writer.flush()
+        self.writer = writer
+        self.resolver = DelegateResolver.build()
+        self.voting_id = Voting.select(fn.Max(Voting.id)).scalar() or 0
+        self.terms = set()
+
+    def add_ballots(self, voting_id, record):
+        delegate_ids = self.resolver.resolve_all(
+            record.voting["term"], [full_name for full_name, _, _ in record.ballots]
+        )
+        names = {}
+        for (full_name, group, result), delegate_id in zip(record.ballots, delegate_ids):
+            if delegate_id is None:
+                print(f"delegate not found: '{full_name}'")
+                count("delegates not found")
+                continue
+            if delegate_id in names:
+                # reported for review like the fuzzy matches, the first ballot is kept
+                print(
+                    f"duplicate ballot of delegate {delegate_id} in {record.file}: "
+                    f"'{names[delegate_id]}' and '{full_name}'"
                 )
+                count("duplicate ballots")
+                self.resolver.duplicate(record.voting["term"], full_name, delegate_id, names[delegate_id])
+                continue
+            names[delegate_id] = full_name
+
+            self.writer.add(
+                Ballot,
+                voting=voting_id,
+                delegate=delegate_id,
+                result=result,
+                group=group,
+            )
+
+    def add(self, record: VotingRecord, changed_file: ChangedFile):
+        print(f"parse: {record.file}")
+        count("voting files parsed")
+        observe("rows per voting file", len(record.ballots))
+        self.terms.add(record.voting["term"])
+        # a file is written completely or not at all, a file that fails
+        # leaves no rows behind and keeps the ids of the following files
+        if changed_file.ingested is None or changed_file.ingested.voting_id is None:
+            with self.writer.unit():
+                voting_id = self.voting_id + 1
+                self.writer.add(Voting, id=voting_id, **record.voting)
+                self.add_ballots(voting_id, record)
+                record_ingested(self.writer, changed_file, voting=voting_id)
+            self.voting_id = voting_id
+            return
+
+        with db.atomic(), self.writer.unit():
+            existing_voting_id = changed_file.ingested.voting_id
+            self.terms.add(Voting.get_by_id(existing_voting_id).term)
+            Ballot.delete().where(Ballot.voting == existing_voting_id).execute()
+            Voting.update(**record.voting) \
+                .where(Voting.id == existing_voting_id).execute()
+            self.add_ballots(existing_voting_id, record)
+            record_ingested(self.writer, changed_file, voting=existing_voting_id)
+            self.writer.flush()
+
+    def close(self):
+        print(f"resolve delegates: {dict(self.resolver.stats)}")
+        self.resolver.report(instrumentation.ReportsFolder / "delegate_names.csv")
+        return self.terms
+
+
+def parse_votings(writer: BatchWriter, jobs=1):
+    votings = VotingsWriter(writer)
+    votings.terms |= remove_vanished()
+    changed = {file.path: file for file in changed_files(voting_files())}
+    for record in read_votings(list(changed), jobs):
+        votings.add(record, changed[record.file])
+    return votings.close()
+
+
+def update_derived(terms=None):
+    # recomputes what is derived from the ballots of the given terms, all if None,
+    # nothing if no term changed
+    changed = terms is None or bool(terms)
+    with stage("indexes"):
+        create_indexes(changed)
+    if not changed:
+        print("unchanged: derived tables")
+        return
+    with stage("rollup"):
+        rollup.update(terms)
+    with stage("matrix"):
+        votes = matrix.load()
+    with stage("similarity"):
+        similarity.update(votes, terms)
 
 
 if __name__ == "__main__":
-    with database(create=True) as db:
-        parse_delegates()
-        parse_votings()
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--batch-size", type=int, default=10000)
+    arguments.add_argument("--jobs", type=int, default=1)
+    arguments.add_argument("--rebuild", action="store_true")
+    instrumentation.add_arguments(arguments)
+    args = arguments.parse_args()
+    instrumentation.start("parser", profile=args.profile)
+
+    with database(create=True, rebuild=args.rebuild) as db, \
+            BatchWriter(args.batch_size, upsert=True) as writer:
+        with stage("delegates"):
+            delegates_changed = parse_delegates(writer)
+        with stage("votings"):
+            terms = parse_votings(writer, jobs=args.jobs)
+            writer.flush()
+        update_derived(None if delegates_changed else terms)
+    instrumentation.report()
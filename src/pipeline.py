@@ -0,0 +1,158 @@
+import time
+import itertools
+import multiprocessing
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import crawler
+import parser
+import instrumentation
+from instrumentation import stage, count, add_time
+from db import database, BatchWriter
+
+QueueSize = 32
+
+
+class Pipeline:
+    # crawls and parses in one run: every voting file is handed to the
+    # parse workers as soon as it is downloaded and written while the
+    # following files are still downloading and parsing
+    def __init__(self, manifest: crawler.DownloadManifest, domain=crawler.Domain,
+                 downloads=10, parsers=2, queue_size=QueueSize, prefetch=4):
+        self.manifest = manifest
+        self.crawler = crawler.Crawler(domain, max_workers=downloads, prefetch=prefetch)
+        self.downloads = ThreadPoolExecutor(max_workers=downloads)
+        # parsing is submitted from the download threads, forking workers
+        # from there could copy locks held by the other threads
+        self.parsers = ProcessPoolExecutor(
+            max_workers=parsers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        self.queue_size = queue_size
+        self.ingested = {}
+        self.vanished = set()
+        self.queued = iter(())
+
+    def listing(self):
+        # voting ids are handed out in file name order, like parser.py does,
+        # so the listing is read completely before the first download, the
+        # pages are prefetched and this costs a few rounds of page requests
+        votings = {}
+        for voting in self.crawler.votings():
+            votings.setdefault(voting.filename, voting)
+        return [votings[filename] for filename in sorted(votings)]
+
+    def fetch(self, voting: crawler.VotingResultsFile):
+        # runs in a download thread, the parsing is queued right away
+        voting.download(crawler.VotingsFolder, self.manifest, self.crawler.session)
+        path = parser.VotingsFolder / voting.filename
+        if not path.exists():
+            return None
+        changed = parser.changed_file(path, self.ingested)
+        if changed is None:
+            count("voting files unchanged")
+            return None
+        return changed, self.parsers.submit(parser.read_voting, path)
+
+    def start(self) -> deque:
+        # at most queue_size files are downloading, parsing or waiting to be
+        # written, the next download starts when the oldest file is written
+        listing = self.listing()
+        filenames = {voting.filename for voting in listing}
+        crawler.remove_unlisted(crawler.VotingsFolder, filenames, self.manifest)
+        self.vanished = parser.remove_vanished(
+            keep={parser.VotingsFolder / filename for filename in filenames}
+        )
+        self.ingested = parser.ingested_files()
+        self.queued = iter(listing)
+        return deque(
+            self.downloads.submit(self.fetch, voting)
+            for voting in itertools.islice(self.queued, self.queue_size)
+        )
+
+    def votings(self, writer: BatchWriter, pending: deque) -> set:
+        # votings are written in listing order whatever finishes first
+        votings = parser.VotingsWriter(writer)
+        votings.terms |= self.vanished
+        try:
+            while pending:
+                start = time.perf_counter()
+                fetched = pending.popleft().result()
+                if fetched is not None:
+                    changed, record = fetched
+                    record = record.result()
+                add_time("wait for votings", time.perf_counter() - start)
+
+                for voting in itertools.islice(self.queued, 1):
+                    pending.append(self.downloads.submit(self.fetch, voting))
+                if fetched is not None:
+                    votings.add(record, changed)
+        except Exception:
+            # a file is added completely or not at all, the votings before
+            # the failed one are kept and the next run continues with it
+            for task in pending:
+                task.cancel()
+            try:
+                writer.flush()
+            except Exception as error:
+                # the error that stopped the votings is the one raised
+                print(f"flush after the failure failed: {error!r}", flush=True)
+            raise
+        return votings.close()
+
+    def run(self, writer: BatchWriter):
+        delegates = self.downloads.submit(
+            crawler.download_delegates_reference_data,
+            f"{self.crawler.domain}{crawler.DelegatesReferenceDataPath}",
+            crawler.DelegatesFolder, self.manifest, self.crawler.session
+        )
+        with stage("listing"):
+            pending = self.start()
+        # the delegates are parsed while the first votings download
+        with stage("delegates"):
+            delegates.result()
+            delegates_changed = parser.parse_delegates(writer)
+        with stage("votings"):
+            terms = self.votings(writer, pending)
+            writer.flush()
+        return None if delegates_changed else terms
+
+    def close(self):
+        self.downloads.shutdown()
+        self.parsers.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--clean", action="store_true")
+    arguments.add_argument("--domain", default=crawler.Domain)
+    arguments.add_argument("--downloads", type=int, default=10)
+    arguments.add_argument("--parsers", type=int, default=2)
+    arguments.add_argument("--queue-size", type=int, default=QueueSize)
+    arguments.add_argument("--prefetch", type=int, default=4)
+    arguments.add_argument("--batch-size", type=int, default=10000)
+    arguments.add_argument("--rebuild", action="store_true")
+    instrumentation.add_arguments(arguments)
+    args = arguments.parse_args()
+    instrumentation.start("pipeline", profile=args.profile)
+
+    if args.clean:
+        crawler.cleanup()
+    crawler.prepare()
+    start = time.perf_counter()
+    with crawler.DownloadManifest(crawler.DownloadManifestPath) as manifest, \
+            database(create=True, rebuild=args.rebuild), \
+            BatchWriter(args.batch_size, upsert=True) as writer:
+        with Pipeline(manifest, args.domain, args.downloads, args.parsers,
+                      args.queue_size, args.prefetch) as pipeline:
+            terms = pipeline.run(writer)
+        print(f"crawled and parsed in {time.perf_counter() - start:.2f}s", flush=True)
+        parser.update_derived(terms)
+    for stat, value in manifest.stats.items():
+        count(f"downloads {stat}", value)
+    instrumentation.report()
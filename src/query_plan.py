@@ -0,0 +1,83 @@
+import re
+import sys
+from contextlib import contextmanager
+from db import database, db
+import generator
+from cache import cache
+
+Scan = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+TableAlias = re.compile(r'"(\w+)" AS "(\w+)"')
+
+
+@contextmanager
+def recorded_queries():
+    queries = []
+    execute_sql = db.execute_sql
+
+    def recording(sql, params=None, *args, **kwargs):
+        queries.append((sql, params))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = recording
+    try:
+        yield queries
+    finally:
+        del db.execute_sql
+
+
+def query_plan(sql: str, params) -> list:
+    cursor = db.cursor()
+    return [
+        row[-1] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+    ]
+
+
+def scanned_table(step: str, aliases: dict):
+    match = Scan.match(step)
+    if match is None:
+        return None
+    return aliases.get(match.group(1), match.group(1))
+
+
+def selects(name: str, queries: list):
+    for sql, params in queries:
+        if sql.lstrip().upper().startswith("SELECT"):
+            yield name, sql, params
+
+
+def analysis_queries():
+    # the cache is emptied before anything is recorded, the template
+    # itself calls analysis functions, e.g. for the terms it plots
+    cache.version_stat = None
+    with recorded_queries() as queries:
+        cache.data_version()
+    yield from selects("cache.data_version", queries)
+    for analysis in generator.iter_analyses():
+        module = generator.import_file(analysis)
+        cache.entries.clear()
+        with recorded_queries() as queries:
+            plotted = generator.plotted_functions(module)
+        yield from selects(f"{analysis.stem}.template", queries)
+        for fn, args in plotted:
+            cache.entries.clear()
+            with recorded_queries() as queries:
+                getattr(module, fn)(*args)
+            yield from selects(f"{analysis.stem}.{fn}{args or ''}", queries)
+
+
+def check():
+    failures = 0
+    for name, sql, params in analysis_queries():
+        plan = query_plan(sql, params)
+        aliases = {alias: table for table, alias in TableAlias.findall(sql)}
+        scans = [
+            step for step in plan if scanned_table(step, aliases) == "ballot"
+        ]
+        print(f"{'FAIL' if scans else 'ok'} {name}: {' | '.join(plan)}")
+        failures += bool(scans)
+    return failures
+
+
+if __name__ == "__main__":
+    with database():
+        sys.exit(1 if check() else 0)
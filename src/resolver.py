@@ -0,0 +1,339 @@
+import re
+import sys
+import csv
+import unicodedata
+from pathlib import Path
+from bisect import bisect_right
+from collections import Counter
+from db import database, DelegateName, DelegateTerm
+
+Transliterations = str.maketrans({
+    "ß": "ss", "æ": "ae", "œ": "oe", "ø": "o", "ł": "l", "đ": "d", "ı": "i",
+})
+Abbreviation = re.compile(r"^(\w{1,4}\.)+$")
+Site = re.compile(r"\(.*?\)")
+AcceptScore = 0.7
+AcceptMargin = 0.15
+# nicknames too far from the name to be matched
+NameAliases = {
+    "Agnes Brugger": "Agnieszka Brugger",
+}
+# the corrections the parser applied to the names in the voting files
+# before they were matched, check() resolves them without
+FormerNameFixes = {
+    "  ": " ",
+    "h.c.": "h. c.",
+    "Dr. Bernd Fabritius": "Dr. Dr. h. c. Bernd Fabritius",
+    "Andre ": "André ",
+    "Aydan Özoguz": "Aydan Özoğuz",
+    "Sevim Dagdelen": "Sevim Dağdelen",
+    "Dr. h. c. Albert Weiler": "Dr. h. c. (NUACA) Albert H. Weiler",
+    "Elvan Korkmaz-Emre": "Elvan Korkmaz",
+    "Michael Link (Heilbronn)": "Michael Georg Link (Heilbronn)",
+    "Eva-Maria Elisabeth Schreiber": "Eva-Maria Schreiber",
+    "Joana Eleonora Cotar": "Joana Cotar",
+    "Albrecht Heinz Erhard Glaser": "Albrecht Glaser",
+    "Konstantin Elias Kuhle": "Konstantin Kuhle",
+    "Michaela Engelmeier-Heite": "Michaela Engelmeier",
+    "Siegfried Kauder (Villingen-Schwenningen)": "Siegfried Kauder (Villingen-Schw.)",
+    "Dr. Andreas Scheuer": "Andreas Scheuer",
+    "Agnes Brugger": "Agnieszka Brugger",
+    "Ronja Schmitt (Althengstett)": "Ronja Schmitt",
+}
+
+
+def normalize(name: str) -> str:
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def fold(name: str) -> str:
+    # lower case ascii without diacritics, parentheses and abbreviations like
+    # titles or initials, so "Dr. h. c. Aydan Özoğuz" becomes "aydan ozoguz"
+    name = unicodedata.normalize("NFKD", name.translate(Transliterations))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(
+        token for token in re.findall(r"[\w.-]+", name.lower())
+        if not Abbreviation.match(token)
+    )
+
+
+def last_name_parts(name: str) -> frozenset:
+    # the parts of the last word of a name without its site,
+    # so "Elvan Korkmaz-Emre" and "Elvan Korkmaz" share "korkmaz"
+    words = fold(Site.sub(" ", name)).split()
+    return frozenset(words[-1].split("-")) - {""} if words else frozenset()
+
+
+def site(name: str) -> str:
+    match = Site.search(name)
+    return fold(match.group()) if match else None
+
+
+def trigrams(name: str) -> frozenset:
+    padded = f" {name} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TermNames:
+    def __init__(self, names):
+        self.names = [(normalize(name), delegate_id)
+                      for name, delegate_id in names]
+        self.starts = []
+        offset = 0
+        for name, _ in self.names:
+            self.starts.append(offset)
+            offset += len(name) + 1
+        self.haystack = "\n".join(name for name, _ in self.names)
+
+    def scan(self, name: str) -> frozenset:
+        delegate_ids = set()
+        position = self.haystack.find(name)
+        while position >= 0:
+            index = bisect_right(self.starts, position) - 1
+            delegate_ids.add(self.names[index][1])
+            position = self.haystack.find(name, position + 1)
+        return frozenset(delegate_ids)
+
+
+class FuzzyNames:
+    # trigram index over the folded names of a term, candidates are scored
+    # by the mean of the dice and overlap coefficients of their trigrams,
+    # the overlap keeps names with additional middle names or sites close
+    def __init__(self, names):
+        self.names = []
+        self.postings = {}
+        for name, delegate_id, last_name in names:
+            key = trigrams(fold(name))
+            for trigram in key:
+                self.postings.setdefault(trigram, []).append(len(self.names))
+            self.names.append((
+                name, delegate_id, len(key), last_name_parts(last_name or name), site(name)
+            ))
+
+    def candidates(self, name: str):
+        key = trigrams(fold(name))
+        shared = Counter()
+        for trigram in key:
+            shared.update(self.postings.get(trigram, ()))
+        last_name = last_name_parts(name)
+        name_site = site(name)
+        best = {}
+        for index, count in shared.items():
+            candidate, delegate_id, size, candidate_last_name, candidate_site = self.names[index]
+            score = (2 * count / (len(key) + size) + count / min(len(key), size)) / 2
+            if score > best.get(delegate_id, (0,))[0]:
+                best[delegate_id] = (
+                    score, candidate, bool(last_name & candidate_last_name),
+                    name_site is not None and name_site == candidate_site
+                )
+        return sorted(
+            ((score, delegate_id, candidate, same_last_name, same_site)
+             for delegate_id, (score, candidate, same_last_name, same_site) in best.items()),
+            key=lambda match: (-match[0], match[1])
+        )
+
+
+class NameMatch:
+    def __init__(self, term, name, status, score=None, delegate_id=None, candidate=None, runner_up=None):
+        self.term = term
+        self.name = name
+        self.status = status
+        self.score = score
+        self.delegate_id = delegate_id
+        self.candidate = candidate
+        self.runner_up = runner_up
+
+
+class DelegateResolver:
+    # a name matches every delegate of the term with a name containing it,
+    # known names and their variants without title and site are precomputed,
+    # names without any match are looked up in the fuzzy index
+    def __init__(self, rows, accept_score=AcceptScore, accept_margin=AcceptMargin):
+        names_by_term = {}
+        fuzzy_names_by_term = {}
+        variants_by_term = {}
+        for term, delegate_id, full_name, title, site, last_name in rows:
+            names_by_term.setdefault(term, []).append((full_name, delegate_id))
+            fuzzy_names_by_term.setdefault(term, []).append((full_name, delegate_id, last_name))
+            variants = variants_by_term.setdefault(term, set())
+            variants.add(normalize(full_name))
+            without_title = full_name
+            if title and without_title.startswith(f"{title} "):
+                without_title = without_title[len(title) + 1:]
+                variants.add(normalize(without_title))
+            for name in [full_name, without_title]:
+                if site and name.endswith(f" {site}"):
+                    variants.add(normalize(name[:-len(site) - 1]))
+
+        self.terms = {
+            term: TermNames(names) for term, names in names_by_term.items()
+        }
+        self.fuzzy = {
+            term: FuzzyNames(names) for term, names in fuzzy_names_by_term.items()
+        }
+        self.index = {
+            (term, variant): self.terms[term].scan(variant)
+            for term, variants in variants_by_term.items()
+            for variant in variants
+        }
+        self.accept_score = accept_score
+        self.accept_margin = accept_margin
+        self.matches = []
+        self.accepted = {}
+        self.stats = Counter()
+
+    @classmethod
+    def build(cls):
+        return cls(
+            DelegateName
+            .select(
+                DelegateTerm.term,
+                DelegateName.delegate,
+                DelegateName.full_name,
+                DelegateName.title,
+                DelegateName.site,
+                DelegateName.last_name,
+            )
+            .join(DelegateTerm, on=(DelegateName.delegate == DelegateTerm.delegate))
+            .tuples()
+        )
+
+    def lookup(self, term: int, full_name: str) -> frozenset:
+        key = (term, normalize(full_name))
+        delegate_ids = self.index.get(key)
+        if delegate_ids is not None:
+            self.stats["index hit" if delegate_ids else "index miss"] += 1
+            return delegate_ids
+
+        term_names = self.terms.get(term)
+        delegate_ids = term_names.scan(key[1]) if term_names else frozenset()
+        self.stats["scan hit" if delegate_ids else "scan miss"] += 1
+        if not delegate_ids and key[1] in NameAliases:
+            self.stats["alias"] += 1
+            delegate_ids = self.lookup(term, NameAliases[key[1]])
+        elif not delegate_ids and term in self.fuzzy:
+            delegate_ids = self.match(term, key[1])
+            if delegate_ids:
+                self.accepted[key] = self.matches[-1]
+        self.index[key] = delegate_ids
+        return delegate_ids
+
+    def match(self, term: int, name: str) -> frozenset:
+        candidates = self.fuzzy[term].candidates(name)
+        if not candidates:
+            self.matches.append(NameMatch(term, name, "unresolved"))
+            self.stats["fuzzy miss"] += 1
+            return frozenset()
+
+        # only a delegate with the same last name is accepted, the
+        # runner-up is the best other delegate whatever their name,
+        # a delegate with the site of the name has no rivals of another site
+        same_last_name = [match for match in candidates if match[3]]
+        score, delegate_id, candidate, same_last_name, same_site = next(
+            (match for match in same_last_name if match[4]),
+            same_last_name[0] if same_last_name else candidates[0]
+        )
+        runner_up = max(
+            (match[0] for match in candidates
+             if match[1] != delegate_id and (match[4] or not same_site)),
+            default=0.0
+        )
+        accepted = same_last_name and score >= self.accept_score \
+            and score - runner_up >= self.accept_margin
+        self.matches.append(NameMatch(
+            term, name, "accepted" if accepted else "rejected",
+            score, delegate_id, candidate, runner_up
+        ))
+        self.stats["fuzzy hit" if accepted else "fuzzy miss"] += 1
+        return frozenset([delegate_id]) if accepted else frozenset()
+
+    def report(self, path: Path):
+        # fuzzy matches for review, accepted ones included
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(path), mode="w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([
+                "term", "name", "status", "score", "delegate", "candidate", "runner up"
+            ])
+            for match in self.matches:
+                writer.writerow([
+                    match.term, match.name, match.status,
+                    None if match.score is None else f"{match.score:.3f}",
+                    match.delegate_id, match.candidate,
+                    None if match.runner_up is None else f"{match.runner_up:.3f}",
+                ])
+        print(f"name matches written to {path}: {Counter(match.status for match in self.matches)}")
+
+    def resolve_all(self, term: int, full_names: list) -> list:
+        # the delegates of the names of one voting, a fuzzy match is dropped
+        # if its delegate has a ballot under a name that matched exactly,
+        # fuzzy matches of several names to the same delegate are all dropped
+        delegate_ids = [self.resolve(term, full_name) for full_name in full_names]
+        fuzzy = [(term, normalize(full_name)) in self.accepted for full_name in full_names]
+        exact = {
+            delegate_id for delegate_id, is_fuzzy in zip(delegate_ids, fuzzy)
+            if delegate_id is not None and not is_fuzzy
+        }
+        fuzzy_matches = Counter(
+            delegate_id for delegate_id, is_fuzzy in zip(delegate_ids, fuzzy) if is_fuzzy
+        )
+        for index, full_name in enumerate(full_names):
+            if not fuzzy[index]:
+                continue
+            if delegate_ids[index] in exact:
+                status = "taken"
+            elif fuzzy_matches[delegate_ids[index]] > 1:
+                status = "contested"
+            else:
+                continue
+            match = self.accepted[(term, normalize(full_name))]
+            self.matches.append(NameMatch(
+                term, match.name, status, match.score,
+                match.delegate_id, match.candidate, match.runner_up
+            ))
+            self.stats[f"fuzzy {status}"] += 1
+            delegate_ids[index] = None
+        return delegate_ids
+
+    def duplicate(self, term: int, full_name: str, delegate_id, kept: str):
+        # a second ballot of a delegate in one voting, the first one is kept
+        self.matches.append(NameMatch(term, full_name, "duplicate", None, delegate_id, kept))
+        self.stats["duplicate"] += 1
+
+    def resolve(self, term: int, full_name: str):
+        delegate_ids = self.lookup(term, full_name)
+        if len(delegate_ids) == 0:
+            return None
+        if len(delegate_ids) > 1:
+            self.stats["ambiguous"] += 1
+            raise Exception(f"ambigous delegate name: {full_name}")
+        return next(iter(delegate_ids))
+
+
+def check(resolver=None) -> int:
+    # every name the parser used to correct resolves to the delegate of
+    # the corrected name, in every term with a name the correction applies to
+    resolver = resolver or DelegateResolver.build()
+    failures = 0
+    for corrupt, correct in FormerNameFixes.items():
+        resolved = 0
+        for term, names in resolver.terms.items():
+            for name, delegate_id in names.names:
+                if correct not in name:
+                    continue
+                try:
+                    found = resolver.resolve(term, name.replace(correct, corrupt))
+                except Exception:
+                    found = None
+                resolved += found == delegate_id
+                if found != delegate_id:
+                    print(f"FAIL '{name.replace(correct, corrupt)}' in term {term}: {found}, expected {delegate_id}")
+                    failures += 1
+        print(f"{'ok' if resolved else 'FAIL'} '{corrupt}': {resolved} names")
+        failures += not resolved
+    return failures
+
+
+if __name__ == "__main__":
+    with database():
+        sys.exit(1 if check() else 0)
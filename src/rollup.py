@@ -0,0 +1,127 @@
+import sys
+import time
+from functools import partial
+from collections import Counter
+from typing import NamedTuple, Callable
+from db import database, db, Ballot, BallotGroup, BallotResult, Voting, Delegate, DelegateName, DelegateTerm, TermGroupResult, TermPartyGender, TermPartyTitle, VotingTally, fn
+
+
+def current_term():
+    return DelegateTerm.select(fn.Max(DelegateTerm.term)).scalar()
+
+
+def in_terms(query, field, terms):
+    if terms is None:
+        return query
+    return query.where(field.in_(list(terms)))
+
+
+def with_names(query):
+    # ballots are grouped by the ids of group and result, the rollups store names
+    return query.switch(Ballot).join(BallotGroup).switch(Ballot).join(BallotResult)
+
+
+def group_results(terms=None):
+    return in_terms(
+        with_names(
+            Ballot
+            .select(Voting.term, BallotGroup.name, BallotResult.name, fn.COUNT(Ballot.voting))
+            .join(Voting)
+        )
+        .group_by(Voting.term, Ballot.group, Ballot.result),
+        Voting.term, terms
+    )
+
+
+def voting_tallies(terms=None):
+    return in_terms(
+        with_names(
+            Ballot
+            .select(Ballot.voting, BallotGroup.name, BallotResult.name, fn.COUNT(Ballot.voting))
+            .join(Voting)
+        )
+        .group_by(Ballot.voting, Ballot.group, Ballot.result),
+        Voting.term, terms
+    )
+
+
+def party_attributes(attribute, terms=None):
+    serving = DelegateTerm.term_until.is_null()
+    return in_terms(
+        DelegateName
+        .select(DelegateTerm.term, Delegate.party, attribute, serving, fn.COUNT(DelegateName.id))
+        .join(Delegate)
+        .join(DelegateTerm)
+        .group_by(DelegateTerm.term, Delegate.party, attribute, serving),
+        DelegateTerm.term, terms
+    )
+
+
+class Rollup(NamedTuple):
+    model: type
+    query: Callable
+    of_terms: Callable
+
+    @property
+    def fields(self):
+        # the rollup columns, in the order of the query columns
+        return [
+            field for field in self.model._meta.sorted_fields
+            if field is not self.model._meta.primary_key
+        ]
+
+
+Rollups = [
+    Rollup(
+        TermGroupResult, group_results,
+        lambda terms: TermGroupResult.term.in_(terms),
+    ),
+    Rollup(
+        VotingTally, voting_tallies,
+        lambda terms: VotingTally.voting.in_(
+            Voting.select(Voting.id).where(Voting.term.in_(terms))
+        ),
+    ),
+    Rollup(
+        TermPartyGender, partial(party_attributes, Delegate.gender),
+        lambda terms: TermPartyGender.term.in_(terms),
+    ),
+    Rollup(
+        TermPartyTitle, partial(party_attributes, DelegateName.title),
+        lambda terms: TermPartyTitle.term.in_(terms),
+    ),
+]
+
+
+def update(terms=None):
+    # recomputes the rollups of the given terms, all terms if terms is None
+    if terms is not None and not terms:
+        return
+    start = time.perf_counter()
+    with db.atomic():
+        for rollup in Rollups:
+            delete = rollup.model.delete()
+            if terms is not None:
+                delete = delete.where(rollup.of_terms(list(terms)))
+            delete.execute()
+            rollup.model.insert_from(rollup.query(terms), rollup.fields).execute()
+    updated = "all terms" if terms is None else f"terms {sorted(terms)}"
+    print(f"rollup {updated}: {time.perf_counter() - start:.2f}s", flush=True)
+
+
+def check():
+    mismatches = 0
+    for rollup in Rollups:
+        expected = Counter(rollup.query().tuples())
+        actual = Counter(rollup.model.select(*rollup.fields).tuples())
+        consistent = expected == actual
+        print(
+            f"{'ok' if consistent else 'FAIL'} {rollup.model._meta.table_name}: "
+            f"{sum(actual.values())} rows"
+        )
+        mismatches += not consistent
+    return mismatches
+
+if __name__ == "__main__":
+    with database():
+        sys.exit(1 if check() else 0)
@@ -0,0 +1,134 @@
+import zipfile
+import posixpath
+from functools import lru_cache
+from pathlib import Path
+import xml.etree.ElementTree as ET
+import xlrd
+
+RelationshipsNamespace = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+@lru_cache(maxsize=None)
+def column_index(letters: str) -> int:
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+def text_of(node) -> str:
+    # concatenates plain and rich text runs, phonetic runs are skipped
+    if local_name(node.tag) == "rPh":
+        return ""
+    text = (node.text or "") if local_name(node.tag) == "t" else ""
+    return text + "".join(text_of(child) for child in node)
+
+
+def first_sheet_path(archive: zipfile.ZipFile) -> str:
+    try:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        relationships = ET.fromstring(
+            archive.read("xl/_rels/workbook.xml.rels")
+        )
+    except KeyError:
+        return "xl/worksheets/sheet1.xml"
+
+    sheet = next(
+        node for node in workbook.iter() if local_name(node.tag) == "sheet"
+    )
+    relationship_id = sheet.get(f"{{{RelationshipsNamespace}}}id")
+    for relationship in relationships:
+        if relationship.get("Id") == relationship_id:
+            target = relationship.get("Target")
+            if target.startswith("/"):
+                return target[1:]
+            return posixpath.normpath(posixpath.join("xl", target))
+    return "xl/worksheets/sheet1.xml"
+
+
+def shared_strings(archive: zipfile.ZipFile) -> list:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as xml:
+        for _, node in ET.iterparse(xml):
+            if local_name(node.tag) != "si":
+                continue
+            if len(node) == 1 and local_name(node[0].tag) == "t":
+                strings.append(node[0].text or "")
+            else:
+                strings.append(text_of(node))
+            node.clear()
+    return strings
+
+
+def read_xlsx_rows(path: Path):
+    with zipfile.ZipFile(path, mode="r") as archive:
+        strings = shared_strings(archive)
+        with archive.open(first_sheet_path(archive)) as xml:
+            row_tag = cell_tag = value_tag = None
+            width = None
+            rows = 0
+            for _, node in ET.iterparse(xml):
+                if row_tag is None:
+                    namespace = node.tag[:-len(local_name(node.tag))]
+                    row_tag, cell_tag, value_tag = (
+                        f"{namespace}{tag}" for tag in ["row", "c", "v"]
+                    )
+                if node.tag != row_tag:
+                    continue
+                # missing rows are yielded empty like xlrd does
+                row_index = int(node.get("r", rows + 1)) - 1
+                for _ in range(row_index - rows):
+                    yield [""] * (width or 0)
+                rows = row_index + 1
+
+                row = []
+                for cell in node:
+                    if cell.tag != cell_tag:
+                        continue
+                    reference = cell.get("r")
+                    if reference:
+                        index = column_index(reference.rstrip("0123456789"))
+                        if index > len(row):
+                            row.extend([""] * (index - len(row)))
+                    kind = cell.get("t")
+                    value = cell.findtext(value_tag)
+                    if kind == "inlineStr":
+                        row.append(text_of(cell))
+                    elif value is None:
+                        row.append("")
+                    elif kind == "s":
+                        row.append(strings[int(value)])
+                    elif kind == "str" or kind == "e":
+                        row.append(value)
+                    elif kind == "b":
+                        row.append(int(value))
+                    else:
+                        row.append(float(value))
+                node.clear()
+                # rows are padded to the header width
+                width = width or len(row)
+                row.extend([""] * (width - len(row)))
+                yield row
+
+
+def read_xls_rows(path: Path):
+    workbook = xlrd.open_workbook(str(path), on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for row in sheet.get_rows():
+            yield [cell.value for cell in row]
+        workbook.unload_sheet(0)
+    finally:
+        workbook.release_resources()
+
+
+def read_rows(path: Path):
+    if Path(path).suffix == ".xlsx":
+        return read_xlsx_rows(path)
+    return read_xls_rows(path)
@@ -0,0 +1,117 @@
+import sys
+import time
+import argparse
+import numpy as np
+import matrix
+from db import database, db, DelegateSimilarity, BatchWriter
+
+Positions = ["ja", "nein", "Enthaltung"]
+Neighbours = 10
+BlockSize = 512
+MinimumVotings = 10
+
+
+def position_matrices(results: np.ndarray):
+    # one 0/1 matrix per position, delegates x votings
+    return [
+        (results == matrix.Results.index(position) + 1).astype(np.float64)
+        for position in Positions
+    ]
+
+
+def top_neighbours(votes: matrix.VoteMatrix, k=Neighbours, block_size=BlockSize, minimum=MinimumVotings):
+    # agreement of two delegates is the share of the votings both voted in
+    # where they voted alike, computed for a block of delegates at a time
+    # so only block_size x delegates products are held in memory
+    positions = position_matrices(np.asarray(votes.results))
+    cast = sum(positions)
+    k = min(k, len(votes.delegate_ids) - 1)
+    for start in range(0, len(votes.delegate_ids), block_size):
+        block = slice(start, start + block_size)
+        same = sum(position[block] @ position.T for position in positions)
+        both = cast[block] @ cast.T
+        similarity = np.divide(
+            same, both, out=np.full(same.shape, -np.inf),
+            where=both >= minimum
+        )
+        rows = np.arange(similarity.shape[0])
+        similarity[rows, rows + start] = -np.inf
+        if k <= 0:
+            continue
+
+        candidates = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        values = np.take_along_axis(similarity, candidates, axis=1)
+        order = np.lexsort((candidates, -values), axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        for row, neighbours in zip(rows, candidates):
+            for rank, neighbour in enumerate(neighbours, 1):
+                value = similarity[row, neighbour]
+                if value == -np.inf:
+                    break
+                yield (
+                    int(votes.delegate_ids[start + row]),
+                    rank,
+                    int(votes.delegate_ids[neighbour]),
+                    float(value),
+                    int(both[row, neighbour]),
+                )
+
+
+def update(votes: matrix.VoteMatrix = None, terms=None, k=Neighbours, block_size=BlockSize):
+    # recomputes the neighbours of the given terms, all terms if terms is None
+    if terms is not None and not terms:
+        return
+    start = time.perf_counter()
+    votes = votes if votes is not None else matrix.load()
+    if terms is None:
+        terms = np.unique(votes.voting_terms)
+    with db.atomic():
+        DelegateSimilarity.delete() \
+            .where(DelegateSimilarity.term.in_([int(term) for term in terms])) \
+            .execute()
+        with BatchWriter() as writer:
+            for term in sorted(int(term) for term in terms):
+                for delegate, rank, neighbour, similarity, votings in top_neighbours(
+                        votes.select(term=term), k, block_size):
+                    writer.add(
+                        DelegateSimilarity,
+                        term=term,
+                        delegate=delegate,
+                        rank=rank,
+                        neighbour=neighbour,
+                        similarity=similarity,
+                        votings=votings,
+                    )
+    print(
+        f"similarity of terms {sorted(int(term) for term in terms)}: "
+        f"{time.perf_counter() - start:.2f}s",
+        flush=True
+    )
+
+
+def neighbours(delegate: int, term: int):
+    return list(
+        DelegateSimilarity
+        .select(DelegateSimilarity.neighbour, DelegateSimilarity.similarity, DelegateSimilarity.votings)
+        .where((DelegateSimilarity.delegate == delegate) & (DelegateSimilarity.term == term))
+        .order_by(DelegateSimilarity.rank)
+        .tuples()
+    )
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser()
+    arguments.add_argument("--delegate", type=int)
+    arguments.add_argument("--term", type=int, action="append")
+    arguments.add_argument("--neighbours", type=int, default=Neighbours)
+    arguments.add_argument("--block-size", type=int, default=BlockSize)
+    args = arguments.parse_args()
+
+    with database():
+        if args.delegate is None:
+            update(terms=args.term, k=args.neighbours, block_size=args.block_size)
+            sys.exit(0)
+        for term in args.term or []:
+            print(f"{term}. Wahlperiode:")
+            for neighbour, similarity, votings in neighbours(args.delegate, term):
+                print(f"  {neighbour}: {similarity:.3f} ({votings} votings)")